@@ -1,5 +1,6 @@
 import os
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
 
@@ -15,16 +16,49 @@ if not DATABASE_URL:
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
+# Particionado declarativo por mes de 'invoices' e 'invoice_items' (solo PostgreSQL).
+# Se activa con DB_PARTITION_BY_MONTH=1 y debe decidirse ANTES de crear las tablas.
+PARTITION_BY_MONTH = (
+    os.getenv("DB_PARTITION_BY_MONTH", "").lower() in ("1", "true", "yes")
+    and DATABASE_URL.startswith("postgresql")
+)
+
 try:
     
     engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-    print(f" Engine configurado para: {DATABASE_URL.split('@')[1]}") 
+    # split('@')[-1] para no mostrar credenciales (y no fallar con URLs sin '@', p.ej. SQLite local)
+    print(f" Engine configurado para: {DATABASE_URL.split('@')[-1]}") 
 except Exception as e:
     print(f" Error creando el engine de base de datos: {e}")
     raise e
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# --- Réplica de lectura (opcional) ---
+# Si DATABASE_READ_URL está definida, las vistas de solo lectura consultan la réplica.
+# Tras una escritura, durante READ_REPLICA_MAX_LAG segundos se sigue leyendo del
+# primario para que el usuario vea lo que acaba de guardar (read-your-own-writes).
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+READ_REPLICA_MAX_LAG = float(os.getenv("READ_REPLICA_MAX_LAG", "5"))
+
+if DATABASE_READ_URL and DATABASE_READ_URL.startswith("postgres://"):
+    DATABASE_READ_URL = DATABASE_READ_URL.replace("postgres://", "postgresql://", 1)
+
+if DATABASE_READ_URL:
+    read_engine = create_engine(DATABASE_READ_URL, pool_pre_ping=True)
+    print(f" Réplica de lectura configurada: {DATABASE_READ_URL.split('@')[-1]}")
+else:
+    read_engine = engine
+
+ReadSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=read_engine, info={"read_only": True}
+)
+
+@event.listens_for(ReadSessionLocal, "before_flush")
+def _bloquear_escrituras_en_replica(session, flush_context, instances):
+    if session.info.get("read_only"):
+        raise RuntimeError("Intento de escritura en una sesión de solo lectura (réplica).")
+
 Base = declarative_base()
 
 def init_db():
@@ -37,16 +71,105 @@ def init_db():
     
     print(" Creando/Verificando tablas en Supabase...")
     Base.metadata.create_all(bind=engine)
+    _migrar_items_denormalizados()
+    _migrar_matriz_precios()
+
+    from database.search_indexes import ensure_search_indexes
+    ensure_search_indexes(engine)
+
+    if PARTITION_BY_MONTH:
+        from datetime import date
+        from database.partitions import ensure_default_partition, ensure_month_partition
+
+        ensure_default_partition()
+        ensure_month_partition(date.today())
+
+    if read_engine is not engine:
+        _comprobar_replica()
     print(" Tablas listas.")
 
-def get_db_session():
+def _comprobar_replica():
+    """
+    La réplica no se crea ni se migra desde aquí: el esquema le llega por replicación.
+    Si le faltan las tablas (p.ej. un SQLite vacío), avisamos en vez de fallar más tarde.
+    """
+    from sqlalchemy import inspect
+
+    try:
+        if not inspect(read_engine).has_table("invoices"):
+            print(
+                " AVISO: la réplica de lectura no tiene la tabla 'invoices'. "
+                "Debe ser una réplica real del primario o una copia de su fichero."
+            )
+    except Exception as e:
+        print(f" AVISO: no se pudo comprobar la réplica de lectura: {e}")
+
+def _migrar_items_denormalizados():
+    """
+    Añade 'user_id' y 'date' a 'invoice_items' en bases de datos creadas antes
+    de la desnormalización y los rellena desde 'invoices'.
+    create_all no altera tablas existentes, así que lo hacemos a mano una vez.
+    """
+    from sqlalchemy import inspect, text
+    from database.models import Invoice, InvoiceItem
+
+    columnas = {c["name"] for c in inspect(engine).get_columns("invoice_items")}
+    faltan = [c for c in ("user_id", "date") if c not in columnas]
+    if not faltan:
+        return
+
+    print(f" Migrando invoice_items: añadiendo {', '.join(faltan)}...")
+    with engine.begin() as conn:
+        for columna in faltan:
+            conn.execute(text(f"ALTER TABLE invoice_items ADD COLUMN {columna} VARCHAR"))
+        conn.execute(text("""
+            UPDATE invoice_items SET
+                user_id = (SELECT invoices.user_id FROM invoices WHERE invoices.id = invoice_items.invoice_id),
+                date = (SELECT invoices.date FROM invoices WHERE invoices.id = invoice_items.invoice_id)
+            WHERE user_id IS NULL OR date IS NULL
+        """))
+        for tabla in (Invoice.__table__, InvoiceItem.__table__):
+            for index in tabla.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+def _migrar_matriz_precios():
+    """
+    Añade 'price_ewma' a 'vendor_prices' si falta. Las filas antiguas no la tienen y
+    guardaban el proveedor sin normalizar: se borran las marcas de construida para que
+    cada matriz se reconstruya entera en la próxima visita al dashboard.
+    """
+    from sqlalchemy import inspect, text
+
+    columnas = {c["name"] for c in inspect(engine).get_columns("vendor_prices")}
+    if "price_ewma" in columnas:
+        return
+
+    print(" Migrando vendor_prices: añadiendo price_ewma...")
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE vendor_prices ADD COLUMN price_ewma FLOAT"))
+        conn.execute(text("DELETE FROM vendor_matrix_status"))
+
+def get_db_session(read_only=False, last_write_at=None):
     """
     Generador que entrega una sesión segura y la cierra al terminar.
     Uso: with get_db_session() as db: ...
+    Con read_only=True se usa la réplica, salvo que 'last_write_at' (time.time()
+    de la última escritura del usuario) esté dentro de READ_REPLICA_MAX_LAG.
     """
-    db = SessionLocal()
+    recent_write = last_write_at is not None and time.time() - last_write_at < READ_REPLICA_MAX_LAG
+    db = ReadSessionLocal() if read_only and not recent_write else SessionLocal()
     try:
         return db
     except Exception as e:
         db.close()
-        raise e
\ No newline at end of file
+        raise e
+
+def get_read_session(state):
+    """
+    Sesión de lectura para las vistas. 'state' es st.session_state (o un dict).
+    """
+    return get_db_session(read_only=True, last_write_at=state.get("db_last_write_at"))
+
+def record_write(state):
+    """Marca que el usuario acaba de escribir: sus próximas lecturas irán al primario."""
+    state["db_last_write_at"] = time.time()
\ No newline at end of file
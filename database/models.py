@@ -1,30 +1,139 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime # <--- Añade String
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index, Text, UniqueConstraint # <--- Añade String
 from sqlalchemy.orm import relationship
-from database.connection import Base
+from database.connection import Base, PARTITION_BY_MONTH
+
+# Con particionado por mes, PostgreSQL exige que la clave de partición ('date')
+# forme parte de la clave primaria, y las FKs hacia una tabla particionada
+# tendrían que incluirla también. En ese modo la integridad factura -> ítems
+# la mantiene el ORM (cascade) en lugar de una FK física.
+_PARTITION_ARGS = {"postgresql_partition_by": "RANGE (date)"} if PARTITION_BY_MONTH else {}
 
 class Invoice(Base):
     __tablename__ = "invoices"
+    __table_args__ = (
+        Index("ix_invoices_user_date", "user_id", "date"),
+        _PARTITION_ARGS,
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     
     user_id = Column(String, index=True) 
 
     vendor = Column(String)
-    date = Column(String)
+    date = Column(String, primary_key=PARTITION_BY_MONTH)
     total_amount = Column(Float)
     currency = Column(String)
     image_url = Column(String)
 
-    items = relationship("InvoiceItem", back_populates="invoice", cascade="all, delete-orphan")
+    items = relationship(
+        "InvoiceItem",
+        primaryjoin="Invoice.id == foreign(InvoiceItem.invoice_id)",
+        back_populates="invoice",
+        cascade="all, delete-orphan",
+    )
+
+    def sync_items(self):
+        """
+        Propaga 'user_id' y 'date' a los ítems (copias desnormalizadas).
+        Llamar siempre que se creen ítems o se edite la factura.
+        """
+        for item in self.items:
+            item.user_id = self.user_id
+            item.date = self.date
 
 class InvoiceItem(Base):
     __tablename__ = "invoice_items"
+    __table_args__ = (
+        # Cubre "último precio de este producto para este usuario antes de X fecha"
+        Index("ix_invoice_items_user_desc_date", "user_id", "description", "date"),
+        _PARTITION_ARGS,
+    )
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    invoice_id = Column(Integer, *([] if PARTITION_BY_MONTH else [ForeignKey("invoices.id")]), index=True)
+
+    # Copias de la factura para filtrar sin JOIN (multi-tenant)
+    user_id = Column(String, index=True)
+    date = Column(String, primary_key=PARTITION_BY_MONTH)
 
-    id = Column(Integer, primary_key=True, index=True)
-    invoice_id = Column(Integer, ForeignKey("invoices.id"))
     description = Column(String)
     quantity = Column(Float)
     unit_price = Column(Float)
     total_price = Column(Float)
 
-    invoice = relationship("Invoice", back_populates="items")
\ No newline at end of file
+    invoice = relationship(
+        "Invoice",
+        primaryjoin="Invoice.id == foreign(InvoiceItem.invoice_id)",
+        back_populates="items",
+    )
+
+class DocumentFingerprint(Base):
+    """
+    Huella de cada documento subido, para detectar duplicados antes de llamar a la IA.
+    'phash' es un dHash de 64 bits en hexadecimal (solo imágenes);
+    'sha256' es el hash exacto del fichero (imágenes y PDFs).
+    """
+    __tablename__ = "document_fingerprints"
+    __table_args__ = (Index("ix_document_fingerprints_user_sha", "user_id", "sha256"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(String, index=True)
+    invoice_id = Column(Integer, index=True)
+    phash = Column(String(16))
+    sha256 = Column(String(64))
+
+
+class VendorTemplate(Base):
+    """
+    Plantilla de lectura local aprendida de facturas confirmadas de un proveedor
+    (PDFs con capa de texto). 'template' es un JSON con etiquetas y columnas.
+    """
+    __tablename__ = "vendor_templates"
+    __table_args__ = (UniqueConstraint("user_id", "vendor", name="uq_vendor_templates_user_vendor"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(String, index=True)
+    vendor = Column(String)
+    template = Column(Text)
+    hits = Column(Integer, default=0)
+    misses = Column(Integer, default=0)
+
+class VendorPrice(Base):
+    """
+    Matriz de precios por (usuario, producto, proveedor), mantenida de forma incremental
+    al guardar/editar/borrar facturas. 'product' es la descripción normalizada.
+    """
+    __tablename__ = "vendor_prices"
+    __table_args__ = (UniqueConstraint("user_id", "product", "vendor", name="uq_vendor_prices_user_product_vendor"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(String, index=True)
+    product = Column(String)
+    vendor = Column(String)
+    last_price = Column(Float)
+    last_date = Column(String)
+    # Media móvil exponencial del precio unitario (ver PRICE_EWMA_ALPHA)
+    price_ewma = Column(Float)
+    price_sum = Column(Float, default=0.0)
+    quantity_sum = Column(Float, default=0.0)
+    purchases = Column(Integer, default=0)
+
+class VendorMatrixStatus(Base):
+    """
+    Marca de que la matriz de precios de un usuario ya se construyó desde su histórico.
+    Sin ella, las filas creadas por subidas sueltas no dicen nada del resto de facturas.
+    """
+    __tablename__ = "vendor_matrix_status"
+
+    user_id = Column(String, primary_key=True)
+    built_at = Column(DateTime)
+
+class UserDataVersion(Base):
+    """
+    Versión de los datos de cada usuario: se incrementa en cada escritura de facturas.
+    Es la clave de la caché del dashboard, compartida por todas sus sesiones.
+    """
+    __tablename__ = "user_data_versions"
+
+    user_id = Column(String, primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
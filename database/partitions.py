@@ -0,0 +1,69 @@
+from datetime import date, datetime
+from sqlalchemy import text
+
+# Tablas particionadas por rango mensual sobre la columna 'date' (YYYY-MM-DD)
+PARTITIONED_TABLES = ("invoices", "invoice_items")
+
+# Sin caché en proceso: otra réplica de la app puede desenganchar particiones, y una
+# caché rellenada antes del commit mentiría tras un rollback. to_regclass es barato.
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+def _engine():
+    from database.connection import engine
+    return engine
+
+def partition_name(table, year, month):
+    return f"{table}_p{year:04d}_{month:02d}"
+
+def month_bounds(year, month):
+    """Devuelve ('YYYY-MM-01', 'YYYY-MM+1-01') para la cláusula FOR VALUES."""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start.isoformat(), end.isoformat()
+
+def ensure_default_partition():
+    """
+    Partición DEFAULT de cada tabla: red de seguridad para que ninguna inserción
+    falle con 'no partition found' aunque falte la del mes.
+    """
+    with _engine().begin() as conn:
+        for table in PARTITIONED_TABLES:
+            conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_pdefault PARTITION OF {table} DEFAULT"))
+
+def ensure_month_partition(fecha):
+    """
+    Crea (si no existen) las particiones del mes de 'fecha' para ambas tablas.
+    Usa su propia conexión y transacción: la DDL queda confirmada aunque el
+    guardado que la pidió haga rollback. Llamar ANTES de abrir la transacción de guardado.
+    """
+    d = _to_date(fecha)
+    start, end = month_bounds(d.year, d.month)
+    for table in PARTITIONED_TABLES:
+        name = partition_name(table, d.year, d.month)
+        try:
+            with _engine().begin() as conn:
+                if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+                    conn.execute(text(
+                        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                        f"FOR VALUES FROM ('{start}') TO ('{end}')"
+                    ))
+        except Exception as e:
+            # P.ej. la DEFAULT ya tiene filas de ese mes: siguen guardándose allí
+            print(f" No se pudo crear la partición {name}: {e}")
+
+def detach_month_partition(year, month):
+    """
+    Desengancha las particiones de un mes. Los datos quedan en tablas sueltas
+    (archivables o borrables con DROP TABLE) sin reescribir el resto.
+    """
+    with _engine().begin() as conn:
+        for table in PARTITIONED_TABLES:
+            name = partition_name(table, year, month)
+            if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None:
+                conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
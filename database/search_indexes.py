@@ -0,0 +1,79 @@
+from sqlalchemy import text
+
+# --- PostgreSQL: trigramas (pg_trgm) + full-text en español ---
+# La expresión del índice FTS debe coincidir EXACTAMENTE con la de services/search.py
+PG_TSVECTOR = "to_tsvector('spanish', coalesce(description, ''))"
+
+PG_STATEMENTS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_invoices_vendor_trgm ON invoices USING gin (vendor gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_invoice_items_description_trgm ON invoice_items USING gin (description gin_trgm_ops)",
+    f"CREATE INDEX IF NOT EXISTS ix_invoice_items_description_fts ON invoice_items USING gin ({PG_TSVECTOR})",
+]
+
+# --- SQLite: tablas FTS5 espejo (tokenizer trigram) mantenidas por triggers ---
+# rowid de la tabla FTS == id de la fila original, así borrar/actualizar es directo.
+SQLITE_STATEMENTS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS invoices_fts
+       USING fts5(vendor, user_id UNINDEXED, tokenize='trigram')""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS invoice_items_fts
+       USING fts5(description, user_id UNINDEXED, invoice_id UNINDEXED, tokenize='trigram')""",
+
+    """CREATE TRIGGER IF NOT EXISTS invoices_fts_ai AFTER INSERT ON invoices BEGIN
+         INSERT INTO invoices_fts(rowid, vendor, user_id) VALUES (new.id, new.vendor, new.user_id);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS invoices_fts_au AFTER UPDATE OF vendor, user_id ON invoices BEGIN
+         DELETE FROM invoices_fts WHERE rowid = old.id;
+         INSERT INTO invoices_fts(rowid, vendor, user_id) VALUES (new.id, new.vendor, new.user_id);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS invoices_fts_ad AFTER DELETE ON invoices BEGIN
+         DELETE FROM invoices_fts WHERE rowid = old.id;
+       END""",
+
+    """CREATE TRIGGER IF NOT EXISTS invoice_items_fts_ai AFTER INSERT ON invoice_items BEGIN
+         INSERT INTO invoice_items_fts(rowid, description, user_id, invoice_id)
+         VALUES (new.id, new.description, new.user_id, new.invoice_id);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS invoice_items_fts_au AFTER UPDATE OF description, user_id, invoice_id ON invoice_items BEGIN
+         DELETE FROM invoice_items_fts WHERE rowid = old.id;
+         INSERT INTO invoice_items_fts(rowid, description, user_id, invoice_id)
+         VALUES (new.id, new.description, new.user_id, new.invoice_id);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS invoice_items_fts_ad AFTER DELETE ON invoice_items BEGIN
+         DELETE FROM invoice_items_fts WHERE rowid = old.id;
+       END""",
+]
+
+# Relleno inicial cuando las tablas FTS se crean sobre datos ya existentes
+SQLITE_BACKFILL = [
+    "INSERT INTO invoices_fts(rowid, vendor, user_id) SELECT id, vendor, user_id FROM invoices",
+    """INSERT INTO invoice_items_fts(rowid, description, user_id, invoice_id)
+       SELECT id, description, user_id, invoice_id FROM invoice_items""",
+]
+
+def ensure_search_indexes(engine):
+    """
+    Crea los índices de búsqueda según el motor:
+    PostgreSQL -> GIN trigram + full-text. SQLite -> FTS5. Otros motores -> no se crea nada.
+    """
+    dialect = engine.dialect.name
+
+    if dialect == "postgresql":
+        try:
+            with engine.begin() as conn:
+                for stmt in PG_STATEMENTS:
+                    conn.execute(text(stmt))
+        except Exception as e:
+            # Sin permisos para pg_trgm la app sigue funcionando (búsqueda sin índice)
+            print(f" No se pudieron crear los índices de búsqueda: {e}")
+
+    elif dialect == "sqlite":
+        with engine.begin() as conn:
+            existe = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'invoices_fts'"
+            )).first()
+            for stmt in SQLITE_STATEMENTS:
+                conn.execute(text(stmt))
+            if not existe:
+                for stmt in SQLITE_BACKFILL:
+                    conn.execute(text(stmt))
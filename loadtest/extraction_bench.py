@@ -0,0 +1,128 @@
+"""
+Benchmark de extracción: misma colección de facturas contra uno o varios proveedores.
+
+Cada factura del directorio (pdf/jpg/png) puede tener al lado un <nombre>.json con los
+datos correctos (mismo formato que devuelve analyze_invoice) para medir precisión.
+
+Grabar una vez contra el modelo real y comparar después sin red ni coste:
+    python -m loadtest.extraction_bench facturas/ --providers gemini:gemini-2.5-flash --record grabaciones/flash.jsonl
+    python -m loadtest.extraction_bench facturas/ --providers gemini:gemini-2.5-pro --record grabaciones/pro.jsonl
+    python -m loadtest.extraction_bench facturas/ --providers replay:grabaciones/flash.jsonl replay:grabaciones/pro.jsonl --concurrency 8
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from services.gemini import analyze_invoice
+from services.providers import build_provider, RecordingProvider
+
+MIME_TYPES = {".pdf": "application/pdf", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+
+def load_dataset(folder):
+    """[(nombre, fichero_simulado, esperado|None)] con la misma interfaz que un UploadedFile."""
+    dataset = []
+    for name in sorted(os.listdir(folder)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in MIME_TYPES:
+            continue
+        with open(os.path.join(folder, name), "rb") as f:
+            data = f.read()
+        expected_path = os.path.join(folder, stem + ".json")
+        expected = None
+        if os.path.exists(expected_path):
+            with open(expected_path, encoding="utf-8") as f:
+                expected = json.load(f)
+        fake_file = types.SimpleNamespace(getvalue=lambda data=data: data, type=MIME_TYPES[ext.lower()])
+        dataset.append((name, fake_file, expected))
+    return dataset
+
+def score(result, expected):
+    """Aciertos por campo (1/0) de una extracción frente a los datos correctos."""
+    def num(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    total_ok = num(result.get("total_amount")) is not None and num(expected.get("total_amount")) is not None \
+        and abs(num(result.get("total_amount")) - num(expected.get("total_amount"))) <= 0.01
+    return {
+        "vendor": int(str(result.get("vendor", "")).strip().lower() == str(expected.get("vendor", "")).strip().lower()),
+        "date": int(str(result.get("date")) == str(expected.get("date"))),
+        "total": int(total_ok),
+        "items": int(len(result.get("items") or []) == len(expected.get("items") or [])),
+    }
+
+def run_provider(spec, dataset, concurrency, record_path=None):
+    provider = build_provider(spec)
+    if record_path:
+        provider = RecordingProvider(provider, record_path)
+
+    def one(entry):
+        name, fake_file, expected = entry
+        started = time.perf_counter()
+        result = analyze_invoice(fake_file, provider=provider)
+        return name, (time.perf_counter() - started) * 1000, result, expected
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        rows = list(pool.map(one, dataset))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(ms for _, ms, _, _ in rows)
+    errors = sum(1 for _, _, result, _ in rows if "error" in result)
+    scores = [score(result, expected) for _, _, result, expected in rows if expected and "error" not in result]
+    accuracy = {
+        field: (sum(s[field] for s in scores) / len(scores) * 100) if scores else None
+        for field in ("vendor", "date", "total", "items")
+    }
+    return {
+        "provider": spec,
+        "model": provider.model,
+        "n": len(rows),
+        "errors": errors,
+        "p50": latencies[len(latencies) // 2] if latencies else 0.0,
+        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0,
+        "mean": statistics.mean(latencies) if latencies else 0.0,
+        "throughput": len(rows) / wall if wall else 0.0,
+        "accuracy": accuracy,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extracción de facturas")
+    parser.add_argument("folder", help="Directorio con facturas y sus .json esperados")
+    parser.add_argument("--providers", nargs="+", default=["gemini"],
+                        help="gemini[:modelo] o replay:fichero.jsonl (uno o varios)")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--record", help="Graba las peticiones/respuestas en este JSONL (un solo proveedor)")
+    args = parser.parse_args()
+
+    if args.record and len(args.providers) != 1:
+        parser.error("--record solo admite un proveedor")
+
+    dataset = load_dataset(args.folder)
+    if not dataset:
+        parser.error(f"No hay facturas en {args.folder}")
+
+    print(f"{'proveedor':<40}{'n':>4}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'fact/s':>8}"
+          f"{'prov%':>7}{'fecha%':>8}{'total%':>8}{'items%':>8}")
+    for spec in args.providers:
+        try:
+            r = run_provider(spec, dataset, args.concurrency, args.record)
+        except Exception as e:
+            print(f"{spec:<40}no disponible: {e}")
+            continue
+        acc = ["-" if v is None else f"{v:.0f}" for v in r["accuracy"].values()]
+        print(f"{spec:<40}{r['n']:>4}{r['errors']:>5}{r['p50']:>9.0f}{r['p95']:>9.0f}{r['throughput']:>8.1f}"
+              f"{acc[0]:>7}{acc[1]:>8}{acc[2]:>8}{acc[3]:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Prueba de carga: N sesiones headless de main.py en paralelo (streamlit.testing AppTest)
+recorriendo login -> dashboard -> historial -> subida, con Auth/Gemini/Resend simulados.
+
+Uso:
+    DATABASE_URL=sqlite:///loadtest.db python -m loadtest.run --levels 1,5,10,25
+    python -m loadtest.run --levels 5,20 --gemini-latency 3 --error-rate 0.05
+
+Antes de medir cada nivel se siembran unas facturas por usuario simulado, para que el
+dashboard y sus filtros trabajen con datos reales y no con la página vacía.
+
+Limitaciones: todas las sesiones comparten proceso (igual que en un contenedor real de
+Streamlit), AppTest no soporta subir ficheros en todas las versiones, así que la subida
+se simula llamando al stub de extracción e inyectando el resultado en la sesión.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+import types
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from loadtest import stubs
+
+stubs.install()
+
+from streamlit.testing.v1 import AppTest
+
+MAIN = os.path.join(ROOT, "main.py")
+
+def _rss_mb():
+    """Memoria residente del proceso en MB (Linux; 0 si no está disponible)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return 0.0
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+class PoolSampler(threading.Thread):
+    """Muestrea conexiones en uso de los pools de SQLAlchemy mientras dura la prueba."""
+
+    def __init__(self, engines, interval=0.01):
+        super().__init__(daemon=True)
+        self.engines = engines
+        self.interval = interval
+        self.samples = defaultdict(list)
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            for name, engine in self.engines.items():
+                checkedout = getattr(engine.pool, "checkedout", None)
+                if checkedout:
+                    self.samples[name].append(checkedout())
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def report(self):
+        out = {}
+        for name, engine in self.engines.items():
+            samples = self.samples.get(name) or [0]
+            size = getattr(engine.pool, "size", lambda: 0)() + max(getattr(engine.pool, "_max_overflow", 0), 0)
+            saturated = sum(1 for s in samples if size and s >= size) / len(samples) * 100
+            out[name] = {"max": max(samples), "capacity": size, "saturated_pct": saturated}
+        return out
+
+def _share_mock_runtime():
+    """
+    AppTest crea un Runtime simulado al empezar cada run y lo borra (None) al acabar.
+    Con varias sesiones en hilos, la primera que termina deja sin runtime a las demás,
+    y mezclar runtimes de distintos runs pierde ficheros del media manager (KeyError).
+    Fijamos el primer runtime simulado y todas las sesiones usan siempre ese mismo,
+    igual que en un servidor real (un único Runtime por proceso).
+    """
+    from streamlit.runtime import Runtime
+
+    pinned = {}
+    lock = threading.Lock()
+
+    def instance(cls):
+        with lock:
+            if "runtime" not in pinned:
+                if cls._instance is None:
+                    raise RuntimeError("Runtime hasn't been created!")
+                pinned["runtime"] = cls._instance
+            return pinned["runtime"]
+
+    def exists(cls):
+        with lock:
+            return "runtime" in pinned or cls._instance is not None
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(exists)
+
+def _pin_app_test_config():
+    """
+    Cada run de AppTest activa 'global.appTest' y lo restaura al terminar. En hilos,
+    el run que acaba antes lo desactiva mientras otros siguen ejecutando, y sus widgets
+    no registran el format_func (KeyError al leerlos). Lo dejamos activo para todo el proceso.
+    """
+    from contextlib import nullcontext
+    from streamlit import config
+    from streamlit.testing.v1 import app_test
+
+    config.set_option("global.appTest", True)
+    app_test.patch_config_options = lambda options: nullcontext()
+
+def _user_id(index):
+    # Igual que stubs.sign_in: el id se deriva del email de la sesión
+    return f"loadtest-cocina{index}"
+
+def seed_users(indexes, invoices_per_user=3):
+    """
+    Facturas de ejemplo para cada usuario simulado que aún no tenga ninguna:
+    una de este mes y el resto repartidas hacia atrás en el año, con sus líneas.
+    """
+    from database.connection import SessionLocal, PARTITION_BY_MONTH
+    from database.models import Invoice, InvoiceItem
+    from database.partitions import ensure_month_partition
+    from services.data_version import bump_data_version
+    from services.price_matrix import record_purchase
+
+    hoy = date.today()
+    fechas = [hoy - timedelta(days=30 * n) for n in range(invoices_per_user)]
+    fechas = [f if f.year == hoy.year else hoy.replace(month=1, day=1) for f in fechas]
+    if PARTITION_BY_MONTH:
+        for fecha in set(fechas):
+            ensure_month_partition(fecha)
+
+    db = SessionLocal()
+    try:
+        for index in indexes:
+            user_id = _user_id(index)
+            if db.query(Invoice.id).filter(Invoice.user_id == user_id).first():
+                continue
+            for fecha in fechas:
+                datos = stubs.SAMPLE_INVOICE
+                invoice = Invoice(
+                    user_id=user_id, vendor=datos["vendor"], date=str(fecha),
+                    total_amount=datos["total_amount"], currency=datos["currency"],
+                )
+                db.add(invoice)
+                db.flush()
+                for item in datos["items"]:
+                    db.add(InvoiceItem(
+                        invoice_id=invoice.id, user_id=user_id, date=str(fecha),
+                        description=item["description"], quantity=item["quantity"],
+                        unit_price=item["unit_price"], total_price=item["total"],
+                    ))
+                record_purchase(db, user_id, datos["vendor"], fecha, datos["items"])
+            bump_data_version(db, user_id)
+        db.commit()
+    finally:
+        db.close()
+
+def _button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+def _radio(at, label):
+    return next(r for r in at.sidebar.radio if r.label == label)
+
+def run_session(index, timings, errors):
+    """Recorre la app como un usuario. Devuelve el AppTest (para medir memoria en vida)."""
+    def step(name, fn):
+        started = time.perf_counter()
+        fn()
+        timings[name].append((time.perf_counter() - started) * 1000)
+        if at.exception:
+            errors[name] += 1
+
+    at = AppTest.from_file(MAIN, default_timeout=120)
+    try:
+        step("login_page", at.run)
+        at.text_input[0].input(f"cocina{index}@loadtest.local")
+        at.text_input[1].input("loadtest")
+        step("login", _button(at, "Entrar").click().run)
+        if "user" not in at.session_state:
+            errors["login"] += 1
+            return at
+
+        step("dashboard", at.run)
+        # Con datos sembrados el filtro siempre existe: si falta, el dashboard no cargó sus datos
+        if any(r.label == "Periodo:" for r in at.sidebar.radio):
+            step("dashboard_filter", _radio(at, "Periodo:").set_value("Este Año").run)
+        else:
+            errors["dashboard_filter"] += 1
+
+        step("history", _radio(at, "Navegación").set_value("Historial").run)
+
+        step("upload_page", _radio(at, "Navegación").set_value("Subir Facturas").run)
+        started = time.perf_counter()
+        datos = stubs.analyze_invoice(None)
+        timings["extraction"].append((time.perf_counter() - started) * 1000)
+        if "error" in datos:
+            errors["extraction"] += 1
+            return at
+        at.session_state["current_invoice"] = datos
+        step("upload_review", at.run)
+        step("upload_save", _button(at, "💾 Guardar en Base de Datos").click().run)
+    except Exception as e:
+        errors[f"harness:{type(e).__name__}"] += 1
+    return at
+
+def run_level(concurrency, sessions, engines):
+    seed_users(range(sessions))
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    sampler = PoolSampler(engines)
+    rss_before = _rss_mb()
+    sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # Se mantienen vivas todas las sesiones hasta el final para medir su memoria
+        apps = list(pool.map(lambda i: run_session(i, timings, errors), range(sessions)))
+    wall = time.perf_counter() - started
+    sampler.stop()
+    rss_after = _rss_mb()
+
+    reruns = sum(len(v) for k, v in timings.items() if k != "extraction")
+    return {
+        "concurrency": concurrency,
+        "sessions": len(apps),
+        "wall_s": wall,
+        "throughput": reruns / wall if wall else 0.0,
+        "timings": timings,
+        "errors": dict(errors),
+        "pool": sampler.report(),
+        "mb_per_session": (rss_after - rss_before) / max(len(apps), 1),
+    }
+
+def print_report(result):
+    print(f"\n=== Concurrencia {result['concurrency']} · {result['sessions']} sesiones · {result['wall_s']:.1f} s ===")
+    print(f"Throughput: {result['throughput']:.1f} reruns/s · Memoria: {result['mb_per_session']:.1f} MB/sesión")
+    print(f"{'paso':<18}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'media':>10}")
+    for name, values in result["timings"].items():
+        print(f"{name:<18}{len(values):>5}{_percentile(values, 50):>10.0f}{_percentile(values, 95):>10.0f}"
+              f"{_percentile(values, 99):>10.0f}{statistics.mean(values):>10.0f}")
+    for name, pool in result["pool"].items():
+        print(f"Pool {name}: máx {pool['max']}/{pool['capacity']} conexiones · saturado {pool['saturated_pct']:.0f}% del tiempo")
+    if result["errors"]:
+        print(f"Errores: {result['errors']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de SousBill con servicios simulados")
+    parser.add_argument("--levels", default="1,5,10", help="Niveles de concurrencia separados por comas")
+    parser.add_argument("--sessions", type=int, default=0, help="Sesiones por nivel (por defecto 2x concurrencia)")
+    parser.add_argument("--auth-latency", type=float, default=stubs.config.auth_latency)
+    parser.add_argument("--gemini-latency", type=float, default=stubs.config.gemini_latency)
+    parser.add_argument("--gemini-jitter", type=float, default=stubs.config.gemini_jitter)
+    parser.add_argument("--resend-latency", type=float, default=stubs.config.resend_latency)
+    parser.add_argument("--error-rate", type=float, default=stubs.config.error_rate)
+    args = parser.parse_args()
+
+    stubs.config.auth_latency = args.auth_latency
+    stubs.config.gemini_latency = args.gemini_latency
+    stubs.config.gemini_jitter = args.gemini_jitter
+    stubs.config.resend_latency = args.resend_latency
+    stubs.config.error_rate = args.error_rate
+
+    # main.py usa rutas relativas (assets/)
+    os.chdir(ROOT)
+
+    from database import connection
+    import views.login
+
+    # El login espera 1 s para mostrar el mensaje de bienvenida: no es carga real
+    views.login.time = types.SimpleNamespace(sleep=lambda seconds: None)
+
+    _share_mock_runtime()
+    _pin_app_test_config()
+
+    engines = {"primario": connection.engine}
+    if connection.read_engine is not connection.engine:
+        engines["réplica"] = connection.read_engine
+
+    # Sesión de calentamiento: imports y cachés de proceso no cuentan como memoria por sesión
+    # Las tablas tienen que existir antes de sembrar (main.py las crea en su primer run)
+    connection.init_db()
+    seed_users(["warmup"])
+    run_session("warmup", defaultdict(list), defaultdict(int))
+
+    for level in [int(x) for x in args.levels.split(",") if x.strip()]:
+        print_report(run_level(level, args.sessions or level * 2, engines))
+
+if __name__ == "__main__":
+    main()
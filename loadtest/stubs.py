@@ -0,0 +1,92 @@
+"""
+Sustitutos locales de Supabase Auth, Gemini y Resend para las pruebas de carga.
+Se instalan en sys.modules ANTES de que main.py importe los servicios reales,
+así no hace falta ninguna clave ni conexión externa.
+"""
+import random
+import sys
+import time
+import types
+from dataclasses import dataclass
+
+@dataclass
+class StubConfig:
+    auth_latency: float = 0.05      # segundos
+    gemini_latency: float = 2.0     # segundos (media)
+    gemini_jitter: float = 0.5      # desviación típica
+    resend_latency: float = 0.1
+    error_rate: float = 0.0         # probabilidad de error en cada llamada externa
+
+config = StubConfig()
+
+def _wait(mean, jitter=0.0):
+    time.sleep(max(0.0, random.gauss(mean, jitter) if jitter else mean))
+
+def _fails():
+    return random.random() < config.error_rate
+
+# --- services.auth ---
+def sign_in(email, password):
+    _wait(config.auth_latency)
+    if _fails():
+        return None
+    # El id del usuario se deriva del email: cada sesión simulada es un restaurante distinto
+    return types.SimpleNamespace(id=f"loadtest-{email.split('@')[0]}", email=email)
+
+def sign_up(email, password):
+    return sign_in(email, password)
+
+def sign_out():
+    _wait(config.auth_latency)
+
+# --- services.gemini ---
+SAMPLE_INVOICE = {
+    "vendor": "Makro",
+    "date": "2026-01-15",
+    "currency": "EUR",
+    "total_amount": 97.02,
+    "items": [
+        {"description": "Aceite oliva virgen 5L", "quantity": 2, "unit_price": 25.5, "total": 51.0},
+        {"description": "Harina trigo 25kg", "quantity": 1, "unit_price": 18.0, "total": 18.0},
+        {"description": "Tomate triturado 3kg", "quantity": 6, "unit_price": 3.2, "total": 19.2},
+    ],
+}
+
+def analyze_invoice(uploaded_file, provider=None):
+    _wait(config.gemini_latency, config.gemini_jitter)
+    if _fails():
+        return {"error": "Error de IA: fallo simulado"}
+    return dict(SAMPLE_INVOICE, items=[dict(i) for i in SAMPLE_INVOICE["items"]])
+
+def analyze_invoice_text(document_text, provider=None):
+    # El prompt de solo texto es más rápido que el del documento completo
+    _wait(config.gemini_latency / 3, config.gemini_jitter / 3)
+    if _fails():
+        return {"error": "Error de IA: fallo simulado"}
+    return dict(SAMPLE_INVOICE, items=[dict(i) for i in SAMPLE_INVOICE["items"]])
+
+# --- resend ---
+class _Emails:
+    @staticmethod
+    def send(params):
+        _wait(config.resend_latency)
+        if _fails():
+            raise RuntimeError("Resend: fallo simulado")
+        return {"id": "stub"}
+
+def install():
+    """Registra los módulos stub. Llamar antes de importar nada de la app."""
+    auth = types.ModuleType("services.auth")
+    auth.sign_in, auth.sign_up, auth.sign_out = sign_in, sign_up, sign_out
+    sys.modules["services.auth"] = auth
+
+    gemini = types.ModuleType("services.gemini")
+    gemini.analyze_invoice = analyze_invoice
+    gemini.analyze_invoice_text = analyze_invoice_text
+    gemini.JSON_INSTRUCTIONS = ""
+    sys.modules["services.gemini"] = gemini
+
+    resend = types.ModuleType("resend")
+    resend.api_key = None
+    resend.Emails = _Emails
+    sys.modules["resend"] = resend
@@ -117,7 +117,12 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-init_db()
+@st.cache_resource
+def _init_db_once():
+    # Una vez por proceso, no en cada rerun de la app
+    init_db()
+
+_init_db_once()
 
 
 if "user" not in st.session_state:
@@ -0,0 +1,18 @@
+from sqlalchemy.orm import Session
+from database.models import UserDataVersion
+
+def get_data_version(db: Session, user_id):
+    """Versión actual de los datos del usuario (0 si nunca ha escrito)."""
+    version = db.query(UserDataVersion.version).filter(UserDataVersion.user_id == user_id).scalar()
+    return version or 0
+
+def bump_data_version(db: Session, user_id):
+    """
+    Incrementa la versión dentro de la transacción de la escritura (no hace commit):
+    si la escritura hace rollback, la versión tampoco cambia.
+    """
+    updated = db.query(UserDataVersion)\
+        .filter(UserDataVersion.user_id == user_id)\
+        .update({UserDataVersion.version: UserDataVersion.version + 1}, synchronize_session=False)
+    if not updated:
+        db.add(UserDataVersion(user_id=user_id, version=1))
@@ -0,0 +1,163 @@
+import hashlib
+import io
+import threading
+from PIL import Image, ImageOps
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from database.models import Invoice, DocumentFingerprint
+
+# Distancia de Hamming máxima (sobre 64 bits) para considerar dos fotos la misma factura
+MAX_DISTANCE = 10
+
+def dhash(image_bytes, size=8):
+    """
+    Difference hash de 64 bits: escala de grises, 9x8 píxeles y compara cada
+    píxel con su vecino. Tolera reescalados, compresión y pequeños cambios de luz.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    img = ImageOps.exif_transpose(img).convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = list(img.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def fingerprint(bytes_data, mime_type):
+    """
+    Devuelve (phash_hex, sha256). Para PDFs no hay phash (Pillow no los renderiza):
+    se detectan por hash exacto y, tras la extracción, por proveedor/fecha/total.
+    """
+    sha = hashlib.sha256(bytes_data).hexdigest()
+    phash = None
+    if mime_type and mime_type.startswith("image/"):
+        try:
+            phash = f"{dhash(bytes_data):016x}"
+        except Exception:
+            phash = None
+    return phash, sha
+
+class BKTree:
+    """
+    Árbol BK sobre distancia de Hamming. Cada nodo es [hash, [invoice_ids], {distancia: hijo}].
+    Las búsquedas por radio solo visitan los hijos con |d - distancia| <= radio.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, payload):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [payload], {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                node[1].append(payload)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, [payload], {}]
+                return
+            node = child
+
+    def search(self, value, radius):
+        """Devuelve [(distancia, payload)] ordenado por distancia."""
+        if self.root is None:
+            return []
+        results = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= radius:
+                results.extend((d, p) for p in node[1])
+            for dist, child in node[2].items():
+                if d - radius <= dist <= d + radius:
+                    stack.append(child)
+        return sorted(results, key=lambda r: r[0])
+
+# Un árbol por usuario en memoria del proceso, con las huellas (id, phash, factura) que contiene.
+# Los ids no llegan en orden (transacciones que confirman tarde, réplicas con retraso), las
+# huellas se borran con sus facturas y SQLite reutiliza ids: en cada búsqueda se contrasta
+# el conjunto completo con la base de datos. '_trees_lock' solo protege el dict; cada
+# usuario tiene su propio cerrojo.
+_trees = {}
+_trees_lock = threading.Lock()
+
+def _entry_for_user(user_id):
+    with _trees_lock:
+        return _trees.setdefault(user_id, {"tree": BKTree(), "rows": set(), "lock": threading.Lock()})
+
+def _search_user_tree(db: Session, user_id, value, max_distance):
+    """
+    Sincroniza el árbol del usuario con sus huellas en BD y busca en él. La consulta
+    se hace fuera del cerrojo: un usuario no hace esperar a los demás.
+    """
+    entry = _entry_for_user(user_id)
+    current = set(
+        db.query(DocumentFingerprint.id, DocumentFingerprint.phash, DocumentFingerprint.invoice_id)
+        .filter(DocumentFingerprint.user_id == user_id, DocumentFingerprint.phash.isnot(None))
+        .all()
+    )
+    with entry["lock"]:
+        if entry["rows"] - current:
+            # Huellas borradas o cambiadas: el árbol BK no admite borrados, se reconstruye
+            entry["tree"], entry["rows"] = BKTree(), set()
+        for row in current - entry["rows"]:
+            fp_id, phash, invoice_id = row
+            entry["tree"].add(int(phash, 16), invoice_id)
+            entry["rows"].add(row)
+        return entry["tree"].search(value, max_distance)
+
+def find_duplicate_uploads(db: Session, user_id, phash, sha256, max_distance=MAX_DISTANCE):
+    """
+    Facturas ya guardadas cuyo documento coincide exactamente (sha256) o se parece
+    visualmente (phash). Devuelve [(distancia, Invoice)], la más parecida primero.
+    """
+    matches = {}
+    exactos = (
+        db.query(DocumentFingerprint.invoice_id)
+        .filter(DocumentFingerprint.user_id == user_id, DocumentFingerprint.sha256 == sha256)
+        .all()
+    )
+    for (invoice_id,) in exactos:
+        matches[invoice_id] = 0
+
+    if phash:
+        for d, invoice_id in _search_user_tree(db, user_id, int(phash, 16), max_distance):
+            matches.setdefault(invoice_id, d)
+
+    if not matches:
+        return []
+
+    # Filtramos facturas ya borradas (el árbol puede conservar huellas antiguas)
+    invoices = db.query(Invoice).filter(Invoice.user_id == user_id, Invoice.id.in_(list(matches))).all()
+    return sorted(((matches[inv.id], inv) for inv in invoices), key=lambda r: r[0])
+
+def find_duplicate_invoices(db: Session, user_id, vendor, date, total, tolerance=0.01):
+    """Facturas con el mismo proveedor, fecha y total (tras la extracción)."""
+    if not vendor or not date:
+        return []
+    return (
+        db.query(Invoice)
+        .filter(
+            Invoice.user_id == user_id,
+            func.lower(Invoice.vendor) == vendor.strip().lower(),
+            Invoice.date == str(date),
+            func.abs(Invoice.total_amount - float(total or 0)) <= tolerance,
+        )
+        .all()
+    )
+
+def save_fingerprint(db: Session, user_id, invoice_id, phash, sha256):
+    """Añade la huella a la sesión (el commit lo hace quien guarda la factura)."""
+    db.add(DocumentFingerprint(user_id=user_id, invoice_id=invoice_id, phash=phash, sha256=sha256))
@@ -0,0 +1,116 @@
+import csv
+import glob
+import os
+import tempfile
+import time
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from database.models import Invoice, InvoiceItem
+
+# Filas que el driver trae del servidor en cada lote. Con PostgreSQL,
+# yield_per activa un cursor de servidor: nunca está todo el histórico en memoria.
+BATCH_SIZE = 1000
+
+# Las exportaciones que nadie descarga (sesión cerrada, pestaña abandonada) se borran
+# pasado este tiempo, en la siguiente exportación de cualquier usuario.
+EXPORT_MAX_AGE_SECONDS = 3600
+EXPORT_PREFIX = "sousbill_export_"
+
+# La generación es en streaming, pero la descarga no: Streamlit lee el fichero entero
+# en memoria del worker y lo retiene en su media manager. Por eso se limita el tamaño.
+EXPORT_MAX_BYTES = int(float(os.getenv("EXPORT_MAX_MB", "50")) * 1024 * 1024)
+
+EXPORT_COLUMNS = [
+    "invoice_id", "date", "vendor", "invoice_total", "currency",
+    "item_description", "quantity", "unit_price", "line_total",
+]
+
+def iter_export_rows(db: Session, user_id: str, date_from, date_to):
+    """
+    Genera una tupla por línea de factura (o una por factura si no tiene líneas)
+    entre date_from y date_to inclusive, ordenadas por fecha.
+    """
+    stmt = (
+        select(
+            Invoice.id, Invoice.date, Invoice.vendor, Invoice.total_amount, Invoice.currency,
+            InvoiceItem.description, InvoiceItem.quantity, InvoiceItem.unit_price, InvoiceItem.total_price,
+        )
+        .outerjoin(InvoiceItem, InvoiceItem.invoice_id == Invoice.id)
+        .where(
+            Invoice.user_id == user_id,
+            Invoice.date >= str(date_from),
+            Invoice.date <= str(date_to),
+        )
+        .order_by(Invoice.date, Invoice.id, InvoiceItem.id)
+        .execution_options(yield_per=BATCH_SIZE)
+    )
+    for row in db.execute(stmt):
+        yield tuple(row)
+
+def write_csv(rows, path):
+    """Escribe las filas en CSV línea a línea. Devuelve el número de filas."""
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:  # BOM para que Excel detecte UTF-8
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+def write_xlsx(rows, path):
+    """Escribe las filas en XLSX con openpyxl en modo write_only (memoria constante)."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Facturas")
+    ws.append(EXPORT_COLUMNS)
+    count = 0
+    for row in rows:
+        ws.append(list(row))
+        count += 1
+    wb.save(path)
+    return count
+
+WRITERS = {
+    "csv": (write_csv, "text/csv"),
+    "xlsx": (write_xlsx, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+def cleanup_old_exports(max_age=EXPORT_MAX_AGE_SECONDS):
+    """Borra del directorio temporal las exportaciones con más de max_age segundos."""
+    limite = time.time() - max_age
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), f"{EXPORT_PREFIX}*")):
+        try:
+            if os.path.getmtime(path) < limite:
+                os.remove(path)
+        except OSError:
+            # Otro proceso la ha borrado antes
+            pass
+
+def read_export(path):
+    """Contenido del fichero exportado; se lee solo cuando el usuario pulsa descargar."""
+    with open(path, "rb") as f:
+        return f.read()
+
+def export_invoices(db: Session, user_id: str, date_from, date_to, fmt="csv"):
+    """
+    Exporta a un fichero temporal en disco y devuelve (ruta, mime_type, filas).
+    El llamante borra el fichero cuando ya no lo necesite; si no lo hace,
+    cleanup_old_exports lo elimina pasado EXPORT_MAX_AGE_SECONDS.
+    Lanza ValueError si el fichero supera EXPORT_MAX_BYTES (no se podría descargar
+    sin cargarlo entero en memoria).
+    """
+    cleanup_old_exports()
+    writer, mime_type = WRITERS[fmt]
+    tmp = tempfile.NamedTemporaryFile(prefix=EXPORT_PREFIX, suffix=f".{fmt}", delete=False)
+    tmp.close()
+    count = writer(iter_export_rows(db, user_id, date_from, date_to), tmp.name)
+    size = os.path.getsize(tmp.name)
+    if size > EXPORT_MAX_BYTES:
+        os.remove(tmp.name)
+        raise ValueError(
+            f"La exportación ocupa {size / 1024 / 1024:.0f} MB (máximo {EXPORT_MAX_BYTES / 1024 / 1024:.0f} MB). "
+            "Reduce el rango de fechas o expórtala en varios tramos."
+        )
+    return tmp.name, mime_type, count
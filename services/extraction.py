@@ -0,0 +1,336 @@
+import io
+import json
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from sqlalchemy.orm import Session
+from database.models import VendorTemplate
+from services.gemini import analyze_invoice, analyze_invoice_text
+
+# Niveles de extracción, del más barato al más caro
+TIER_TEMPLATE = "plantilla_local"   # PDF con texto + plantilla aprendida del proveedor (sin IA)
+TIER_TEXT = "texto_ia"              # PDF con texto, prompt solo-texto a Gemini
+TIER_DOCUMENT = "documento_ia"      # Documento completo (imagen/PDF escaneado) a Gemini
+TIERS = (TIER_TEMPLATE, TIER_TEXT, TIER_DOCUMENT)
+# Extracciones en las que la IA falló: se cuentan aparte para no inflar ningún nivel
+EXTRACTION_ERROR = "error"
+
+# Por debajo de esto consideramos que el PDF es un escaneo sin capa de texto útil
+MIN_TEXT_CHARS = 200
+
+# Una plantilla con más fallos que aciertos (y al menos 3 fallos) deja de usarse
+MAX_TEMPLATE_MISSES = 3
+
+DATE_FORMATS = {
+    "%d/%m/%Y": r"\d{1,2}/\d{1,2}/\d{4}",
+    "%d-%m-%Y": r"\d{1,2}-\d{1,2}-\d{4}",
+    "%d.%m.%Y": r"\d{1,2}\.\d{1,2}\.\d{4}",
+    "%Y-%m-%d": r"\d{4}-\d{2}-\d{2}",
+    "%d/%m/%y": r"\d{1,2}/\d{1,2}/\d{2}",
+}
+NUMBER_RE = r"-?\d(?:[\d.,]*\d)?"
+CURRENCY_TOKENS = {"€", "eur", "euros"}
+
+# --- Métricas por nivel (por proceso) ---
+_stats = Counter()
+_stats_ms = defaultdict(float)
+_stats_lock = threading.Lock()
+
+def _record(tier, started):
+    with _stats_lock:
+        _stats[tier] += 1
+        _stats_ms[tier] += (time.perf_counter() - started) * 1000
+
+def tier_stats():
+    """
+    [{tier, count, pct, avg_ms}] para cada nivel (y los errores) desde que arrancó el
+    proceso. Los porcentajes son sobre todos los intentos, errores incluidos.
+    """
+    with _stats_lock:
+        total = sum(_stats.values())
+        return [
+            {
+                "tier": tier,
+                "count": _stats[tier],
+                "pct": (_stats[tier] / total * 100) if total else 0.0,
+                "avg_ms": (_stats_ms[tier] / _stats[tier]) if _stats[tier] else 0.0,
+            }
+            for tier in TIERS + (EXTRACTION_ERROR,)
+        ]
+
+# --- Utilidades de texto ---
+def parse_number(raw):
+    """'1.234,56' / '1,234.56' / '12,5' / '12.5' -> float (None si no es un número)."""
+    s = raw.strip()
+    if "," in s and "." in s:
+        if s.rfind(",") > s.rfind("."):
+            s = s.replace(".", "").replace(",", ".")
+        else:
+            s = s.replace(",", "")
+    elif "," in s:
+        s = s.replace(",", ".")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+def extract_pdf_text(bytes_data):
+    """Texto de la capa de texto del PDF ('' si no hay o si pypdf no está instalado)."""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return ""
+    try:
+        reader = PdfReader(io.BytesIO(bytes_data))
+        return "\n".join(page.extract_text() or "" for page in reader.pages)
+    except Exception:
+        return ""
+
+def _lines(text):
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+def _label_before(line, index):
+    """
+    Últimas (hasta 3) palabras con letras justo antes de 'index', sin ':'.
+    Se corta en la primera palabra sin letras (nº de factura, importes...).
+    """
+    words = []
+    for word in reversed(line[:index].replace(":", " ").split()):
+        if len(words) == 3 or not re.search(r"[^\W\d_]", word):
+            break
+        words.insert(0, word)
+    return " ".join(words) or None
+
+def _split_trailing_numbers(line):
+    """
+    Separa 'Aceite oliva 5L  2  12,50  25,00 €' en ('Aceite oliva 5L', [2.0, 12.5, 25.0]).
+    Ignora símbolos de moneda y '%'.
+    """
+    tokens = line.split()
+    numbers = []
+    while tokens:
+        token = tokens[-1].strip("€%")
+        if tokens[-1].lower() in CURRENCY_TOKENS or not token:
+            tokens.pop()
+            continue
+        if not re.fullmatch(NUMBER_RE, token):
+            break
+        value = parse_number(token)
+        if value is None:
+            break
+        numbers.insert(0, value)
+        tokens.pop()
+    return " ".join(tokens), numbers
+
+def _close(a, b):
+    return a is not None and b is not None and abs(float(a) - float(b)) <= max(0.005, abs(float(b)) * 0.005)
+
+def _match_columns(numbers, item):
+    """
+    Asigna cada número de la línea a total / unit_price / quantity, de derecha a
+    izquierda (el total suele ir al final). Columnas sin correspondencia -> None.
+    """
+    pending = ["total", "unit_price", "quantity"]
+    layout = []
+    for value in reversed(numbers):
+        column = next((c for c in pending if _close(value, item.get(c))), None)
+        if column:
+            pending.remove(column)
+        layout.insert(0, column)
+    return tuple(layout)
+
+# --- Plantillas ---
+def learn_template(text, data):
+    """
+    Aprende una plantilla a partir del texto del PDF y los datos CONFIRMADOS por el usuario:
+    la etiqueta que precede a la fecha y al total, y el orden de las columnas numéricas
+    de las líneas de producto. Devuelve None si el documento no encaja.
+    """
+    lines = _lines(text)
+    vendor = (data.get("vendor") or "").strip()
+    if not vendor or vendor.lower() not in text.lower():
+        return None
+
+    try:
+        fecha = datetime.strptime(str(data.get("date"))[:10], "%Y-%m-%d")
+    except ValueError:
+        return None
+
+    date_label = date_format = None
+    for fmt in DATE_FORMATS:
+        needle = fecha.strftime(fmt)
+        for line in lines:
+            i = line.find(needle)
+            if i > 0 and _label_before(line, i):
+                date_label, date_format = _label_before(line, i), fmt
+                break
+        if date_label:
+            break
+    if not date_label:
+        return None
+
+    total = float(data.get("total_amount") or 0)
+    total_label = None
+    for line in reversed(lines):
+        for m in re.finditer(NUMBER_RE, line):
+            if _close(parse_number(m.group()), total) and _label_before(line, m.start()):
+                total_label = _label_before(line, m.start())
+        if total_label:
+            break
+    if not total_label:
+        return None
+
+    layouts = Counter()
+    for item in data.get("items") or []:
+        description = str(item.get("description") or "").strip().lower()
+        if not description:
+            continue
+        for line in lines:
+            if line.lower().startswith(description):
+                _, numbers = _split_trailing_numbers(line)
+                layout = _match_columns(numbers, item)
+                if "total" in layout:
+                    layouts[layout] += 1
+                break
+    if not layouts:
+        return None
+
+    return {
+        "vendor": vendor,
+        "anchor": vendor.lower(),
+        "date_label": date_label,
+        "date_format": date_format,
+        "total_label": total_label,
+        "item_columns": list(layouts.most_common(1)[0][0]),
+        "currency": data.get("currency") or "EUR",
+    }
+
+def apply_template(text, template):
+    """
+    Extrae los datos con una plantilla. Devuelve None si el documento no es de ese
+    proveedor o si el resultado no es coherente (suma de líneas vs total).
+    """
+    if template["anchor"] not in text.lower():
+        return None
+
+    m = re.search(
+        re.escape(template["date_label"]) + r"\W*(" + DATE_FORMATS[template["date_format"]] + ")",
+        text, re.IGNORECASE,
+    )
+    if not m:
+        return None
+    try:
+        date = datetime.strptime(m.group(1), template["date_format"]).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+    totals = re.findall(re.escape(template["total_label"]) + r"\W*(" + NUMBER_RE + ")", text, re.IGNORECASE)
+    total = parse_number(totals[-1]) if totals else None
+    if not total:
+        return None
+
+    columns = template["item_columns"]
+    skip = (template["date_label"].lower(), template["total_label"].lower())
+    items = []
+    for line in _lines(text):
+        if any(label in line.lower() for label in skip):
+            continue
+        description, numbers = _split_trailing_numbers(line)
+        if len(numbers) != len(columns) or not re.search(r"[^\W\d_]", description):
+            continue
+        values = {c: v for c, v in zip(columns, numbers) if c}
+        quantity = values.get("quantity", 1.0) or 1.0
+        line_total = values["total"]
+        items.append({
+            "description": description,
+            "quantity": quantity,
+            "unit_price": values.get("unit_price", round(line_total / quantity, 4)),
+            "total": line_total,
+        })
+
+    # Las líneas suelen ir sin IVA: la suma debe quedar entre total/1.22 y el total
+    suma = sum(i["total"] for i in items)
+    if not items or not (total / 1.22 <= suma <= total * 1.01):
+        return None
+
+    return {
+        "vendor": template["vendor"],
+        "date": date,
+        "currency": template["currency"],
+        "total_amount": total,
+        "items": items,
+    }
+
+# --- Orquestación ---
+def extract_invoice(db: Session, user_id, uploaded_file):
+    """
+    Extractor por niveles delante de analyze_invoice:
+      1. PDF con texto + plantilla aprendida del proveedor (local, milisegundos).
+      2. PDF con texto -> Gemini solo con texto.
+      3. Documento completo -> Gemini (imágenes y PDFs escaneados).
+    Devuelve (datos, nivel, texto_pdf).
+    """
+    started = time.perf_counter()
+    text = ""
+    if uploaded_file.type == "application/pdf":
+        text = extract_pdf_text(uploaded_file.getvalue())
+
+    if len(text.strip()) >= MIN_TEXT_CHARS:
+        templates = db.query(VendorTemplate).filter(VendorTemplate.user_id == user_id).all()
+        for row in templates:
+            if (row.misses or 0) >= MAX_TEMPLATE_MISSES and (row.misses or 0) > (row.hits or 0):
+                continue
+            datos = apply_template(text, json.loads(row.template))
+            if datos:
+                _record(TIER_TEMPLATE, started)
+                return datos, TIER_TEMPLATE, text
+
+        datos = analyze_invoice_text(text)
+        if datos and "error" not in datos and datos.get("items"):
+            _record(TIER_TEXT, started)
+            return datos, TIER_TEXT, text
+
+    datos = analyze_invoice(uploaded_file)
+    _record(EXTRACTION_ERROR if not datos or "error" in datos else TIER_DOCUMENT, started)
+    return datos, TIER_DOCUMENT, text
+
+def confirm_extraction(db: Session, user_id, text, tier, extracted, confirmed):
+    """
+    Llamar al guardar una factura. Aprende/actualiza la plantilla del proveedor con
+    los datos confirmados y, si vino de una plantilla, anota acierto o fallo.
+    No hace commit (lo hace quien guarda la factura).
+    """
+    if not text:
+        return
+
+    # Primero el acierto/fallo de la plantilla usada, aunque luego no se pueda re-aprender:
+    # las plantillas que más corrige el usuario son justo las que deben acabar descartadas
+    if tier == TIER_TEMPLATE and extracted:
+        used = db.query(VendorTemplate).filter(
+            VendorTemplate.user_id == user_id, VendorTemplate.vendor == extracted.get("vendor")
+        ).first()
+        if used is not None:
+            acierto = (
+                _close(extracted.get("total_amount"), confirmed.get("total_amount"))
+                and extracted.get("date") == str(confirmed.get("date"))
+                and len(extracted.get("items") or []) == len(confirmed.get("items") or [])
+            )
+            if acierto:
+                used.hits = (used.hits or 0) + 1
+            else:
+                used.misses = (used.misses or 0) + 1
+
+    template = learn_template(text, confirmed)
+    if template is None:
+        return
+
+    row = db.query(VendorTemplate).filter(
+        VendorTemplate.user_id == user_id, VendorTemplate.vendor == template["vendor"]
+    ).first()
+    if row is None:
+        row = VendorTemplate(user_id=user_id, vendor=template["vendor"], hits=0, misses=0)
+        db.add(row)
+
+    row.template = json.dumps(template, ensure_ascii=False)
@@ -1,27 +1,52 @@
-import google.generativeai as genai
-import os
 import json
 from dotenv import load_dotenv
+from services.providers import get_provider
 
 load_dotenv()
 
-# Intentamos configurar la API. Si falla aquí, lo capturaremos en la función.
-try:
-    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-except Exception as e:
-    print(f"Error configurando API Key: {e}")
+# El modelo concreto (Gemini, grabación o replay) lo decide services/providers.py
 
-def analyze_invoice(uploaded_file):
+JSON_INSTRUCTIONS = """
+        Extrae y devuelve SOLO un JSON con:
+        {
+            "vendor": "Nombre proveedor",
+            "date": "YYYY-MM-DD",
+            "currency": "EUR",
+            "total_amount": 0.00,
+            "items": [{"description": "Item", "quantity": 1, "unit_price": 0.0, "total": 0.0}]
+        }
+        Si no encuentras datos, usa 0 o vacíos. No uses markdown.
+        """
+
+def _parse_response(text):
+    text_response = text.replace("```json", "").replace("```", "").strip()
+    return json.loads(text_response)
+
+def analyze_invoice_text(document_text, provider=None):
     """
-    Analiza facturas (PDF o Imagen) con Gemini Flash.
-    Devuelve un diccionario con los datos o un diccionario con la clave 'error'.
+    Variante barata para PDFs con capa de texto: envía solo el texto extraído
+    (muchos menos tokens que el documento). Mismo formato de salida que analyze_invoice.
     """
-    # Verificación 1: ¿Tenemos API Key?
-    if not os.getenv("GOOGLE_API_KEY"):
-        return {"error": "Falta la GOOGLE_API_KEY en los Secrets (.env)."}
+    try:
+        provider = provider or get_provider()
+        prompt = """
+        Actúa como experto contable. Este es el texto de una factura:
+        ---
+        """ + document_text + """
+        ---
+        """ + JSON_INSTRUCTIONS
+        return _parse_response(provider.generate([prompt]))
+    except Exception as e:
+        return {"error": f"Error de IA: {str(e)}"}
 
+def analyze_invoice(uploaded_file, provider=None):
+    """
+    Analiza facturas (PDF o Imagen) con el proveedor configurado (Gemini Flash por defecto).
+    Devuelve un diccionario con los datos o un diccionario con la clave 'error'.
+    """
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
+        # Verificación 1: ¿Tenemos proveedor? (con Gemini, falla aquí si falta la API Key)
+        provider = provider or get_provider()
 
         # Verificación 2: ¿El archivo es válido?
         if uploaded_file is None:
@@ -37,28 +62,17 @@ def analyze_invoice(uploaded_file):
         # 2. PROMPT
         prompt = """
         Actúa como experto contable. Analiza este documento (imagen o PDF).
-        Extrae y devuelve SOLO un JSON con:
-        {
-            "vendor": "Nombre proveedor",
-            "date": "YYYY-MM-DD",
-            "currency": "EUR",
-            "total_amount": 0.00,
-            "items": [{"description": "Item", "quantity": 1, "unit_price": 0.0, "total": 0.0}]
-        }
-        Si no encuentras datos, usa 0 o vacíos. No uses markdown.
-        """
+        """ + JSON_INSTRUCTIONS
 
         document_blob = {"mime_type": mime_type, "data": bytes_data}
 
         # 3. LLAMADA A LA IA
-        response = model.generate_content([prompt, document_blob])
+        response_text = provider.generate([prompt, document_blob])
         
         # 4. LIMPIEZA
-        text_response = response.text.replace("```json", "").replace("```", "").strip()
-        
-        return json.loads(text_response)
+        return _parse_response(response_text)
 
     except Exception as e:
         # AQUÍ ESTÁ LA SOLUCIÓN:
         # En lugar de devolver None, devolvemos el error exacto para verlo en pantalla
-        return {"error": f"Error de IA: {str(e)}"}
\ No newline at end of file
+        return {"error": f"Error de IA: {str(e)}"}
@@ -0,0 +1,172 @@
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import bindparam, delete, exists, func, select, update
+from sqlalchemy.orm import Session
+from database.connection import PARTITION_BY_MONTH
+from database.partitions import ensure_month_partition
+from database.models import Invoice, InvoiceItem, DocumentFingerprint
+from services.price_matrix import affected_keys, refresh_keys
+from services.data_version import bump_data_version
+
+INVOICE_COLUMNS = ["vendor", "date", "total_amount", "currency"]
+ITEM_COLUMNS = ["description", "quantity", "unit_price", "total_price"]
+# Cambios en estas columnas de una línea alteran el total de su factura
+ITEM_AMOUNT_COLUMNS = {"quantity", "unit_price", "total_price"}
+
+def _clean(value):
+    # pandas usa NaN para celdas vacías; en BD queremos NULL
+    return None if value != value else value
+
+def check_date(value):
+    """Las fechas se guardan como texto YYYY-MM-DD y se comparan como texto: exigimos ese formato exacto."""
+    try:
+        if datetime.strptime(str(value), "%Y-%m-%d").strftime("%Y-%m-%d") == value:
+            return
+    except ValueError:
+        pass
+    raise ValueError(f"Fecha no válida '{value}': usa el formato YYYY-MM-DD")
+
+def compute_diff(original_rows, edited_rows, columns, delete_flag="delete"):
+    """
+    Compara dos listas de dicts (misma 'id') y devuelve (updates, deletes):
+      updates -> {id: {columna: valor_nuevo}} solo con lo que ha cambiado
+      deletes -> [id] de las filas marcadas para borrar
+    """
+    original = {row["id"]: row for row in original_rows}
+    updates, deletes = {}, []
+    for row in edited_rows:
+        row_id = row["id"]
+        if row_id not in original:
+            continue
+        if row.get(delete_flag):
+            deletes.append(row_id)
+            continue
+        changes = {
+            c: _clean(row[c]) for c in columns
+            if _clean(row.get(c)) != _clean(original[row_id].get(c))
+        }
+        if changes:
+            updates[row_id] = changes
+    return updates, deletes
+
+def _bulk_update(db, table, user_id, updates):
+    """
+    Un UPDATE por cada combinación de columnas cambiadas, ejecutado en lote
+    (executemany) con todas las filas que comparten esa combinación.
+    """
+    groups = defaultdict(list)
+    for row_id, changes in updates.items():
+        groups[tuple(sorted(changes))].append({"b_id": row_id, **{f"v_{c}": v for c, v in changes.items()}})
+
+    for columns, params in groups.items():
+        # Los bindparam no pueden llamarse igual que las columnas del SET
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("b_id"), table.c.user_id == user_id)
+            .values({c: bindparam(f"v_{c}") for c in columns})
+        )
+        db.execute(stmt, params)
+
+def apply_history_diff(db: Session, user_id, invoice_updates, invoice_deletes, item_updates, item_deletes):
+    """
+    Aplica todos los cambios de la edición en lote en UNA transacción y recalcula
+    los datos derivados una sola vez. Devuelve un resumen con lo aplicado.
+    """
+    invoices = Invoice.__table__
+    items = InvoiceItem.__table__
+
+    for changes in invoice_updates.values():
+        if "date" in changes:
+            check_date(changes["date"])
+
+    # Si cambian cantidad o precio y no se tocó el importe, se recalcula la línea
+    for changes in item_updates.values():
+        if ("quantity" in changes or "unit_price" in changes) and "total_price" not in changes:
+            changes["_recompute_total"] = True
+    recompute_ids = [i for i, c in item_updates.items() if c.pop("_recompute_total", False)]
+
+    if PARTITION_BY_MONTH:
+        # Las particiones se crean en su propia transacción, que bloquea la tabla padre:
+        # antes se cierra la transacción de lectura de esta sesión (no tiene nada pendiente)
+        db.rollback()
+        for fecha in {c["date"] for c in invoice_updates.values() if c.get("date")}:
+            ensure_month_partition(fecha)
+
+    try:
+        # Celdas de la matriz de precios afectadas, con los valores de antes del cambio
+        claves = affected_keys(
+            db, user_id,
+            invoice_ids=set(invoice_updates) | set(invoice_deletes),
+            item_ids=set(item_updates) | set(item_deletes),
+        )
+
+        # Facturas cuyo total depende de líneas editadas o borradas. Si en el lote se ha
+        # escrito el total a mano, o la factura se borra, se respeta/ignora
+        amount_item_ids = set(item_deletes) | {i for i, c in item_updates.items() if ITEM_AMOUNT_COLUMNS & set(c)}
+        retotal_ids = set()
+        if amount_item_ids:
+            retotal_ids = {
+                invoice_id for (invoice_id,) in db.execute(
+                    select(items.c.invoice_id).where(items.c.id.in_(amount_item_ids), items.c.user_id == user_id)
+                )
+            }
+            retotal_ids -= set(invoice_deletes)
+            retotal_ids -= {i for i, c in invoice_updates.items() if "total_amount" in c}
+
+        _bulk_update(db, invoices, user_id, invoice_updates)
+        _bulk_update(db, items, user_id, item_updates)
+
+        if recompute_ids:
+            db.execute(
+                update(items)
+                .where(items.c.id.in_(recompute_ids), items.c.user_id == user_id)
+                .values(total_price=items.c.quantity * items.c.unit_price)
+            )
+
+        # Derivado: copia desnormalizada de la fecha en los ítems, un único lote
+        date_changes = [{"b_invoice_id": i, "b_date": c["date"]} for i, c in invoice_updates.items() if "date" in c]
+        if date_changes:
+            db.execute(
+                update(items)
+                .where(items.c.invoice_id == bindparam("b_invoice_id"), items.c.user_id == user_id)
+                .values(date=bindparam("b_date")),
+                date_changes,
+            )
+
+        if item_deletes:
+            db.execute(delete(items).where(items.c.id.in_(item_deletes), items.c.user_id == user_id))
+        if invoice_deletes:
+            db.execute(delete(items).where(items.c.invoice_id.in_(invoice_deletes), items.c.user_id == user_id))
+            db.execute(delete(DocumentFingerprint.__table__).where(
+                DocumentFingerprint.invoice_id.in_(invoice_deletes), DocumentFingerprint.user_id == user_id
+            ))
+            db.execute(delete(invoices).where(invoices.c.id.in_(invoice_deletes), invoices.c.user_id == user_id))
+
+        # Derivado: total de la factura = suma de sus líneas (dashboard y exportación leen
+        # total_amount). Una factura que se queda sin líneas conserva su total.
+        if retotal_ids:
+            own_items = (items.c.invoice_id == invoices.c.id) & (items.c.user_id == user_id)
+            line_sum = select(func.coalesce(func.sum(items.c.total_price), 0.0)).where(own_items).scalar_subquery()
+            db.execute(
+                update(invoices)
+                .where(invoices.c.id.in_(retotal_ids), invoices.c.user_id == user_id, exists().where(own_items))
+                .values(total_amount=line_sum)
+            )
+
+        # Derivado: matriz de precios, recalculada una vez para todo el lote
+        claves |= affected_keys(db, user_id, invoice_ids=set(invoice_updates), item_ids=set(item_updates))
+        refresh_keys(db, user_id, claves)
+        bump_data_version(db, user_id)
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return {
+        "invoices_updated": len(invoice_updates),
+        "invoices_deleted": len(invoice_deletes),
+        "items_updated": len(item_updates),
+        "items_deleted": len(item_deletes),
+        "invoices_retotaled": len(retotal_ids),
+    }
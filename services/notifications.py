@@ -1,7 +1,7 @@
 import os
 import resend
 from sqlalchemy.orm import Session
-from database.models import Invoice, InvoiceItem
+from database.models import InvoiceItem
 from sqlalchemy import desc
 
 
@@ -12,15 +12,16 @@ def obtener_precio_anterior(db: Session, user_id: str, description: str, current
     Busca la última vez que compramos este ítem antes de la fecha actual
     para comparar el precio.
     """
+    # 'user_id' y 'date' están copiados en el ítem: sin JOIN con invoices,
+    # resuelto por el índice (user_id, description, date)
     last_purchase = (
         db.query(InvoiceItem)
-        .join(Invoice)
         .filter(
-            Invoice.user_id == user_id,
+            InvoiceItem.user_id == user_id,
             InvoiceItem.description == description,
-            Invoice.date < current_date 
+            InvoiceItem.date < current_date 
         )
-        .order_by(desc(Invoice.date)) 
+        .order_by(desc(InvoiceItem.date)) 
         .first()
     )
     
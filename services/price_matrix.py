@@ -0,0 +1,183 @@
+from collections import defaultdict
+from datetime import datetime
+import pandas as pd
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+from database.models import Invoice, InvoiceItem, VendorPrice, VendorMatrixStatus
+
+# Peso de la última compra en la media reciente (EWMA): con 0.3, las compras de hace
+# más de ~10 pedidos apenas cuentan, a diferencia de la media de toda la vida
+PRICE_EWMA_ALPHA = 0.3
+
+def normalize_product(description):
+    """Clave de producto: misma descripción con distinto formato cuenta como el mismo producto."""
+    return " ".join(str(description or "").lower().split())
+
+def normalize_vendor(vendor):
+    """Clave de proveedor, con la misma regla: 'Makro' y 'MAKRO ' son el mismo."""
+    return normalize_product(vendor)
+
+def _vendor_filter(vendors):
+    """
+    Prefiltro SQL (superconjunto) de facturas de estos proveedores normalizados: cada
+    espacio admite cualquier separación. El filtro exacto se hace después en Python.
+    """
+    patterns = []
+    for vendor in vendors:
+        escaped = vendor.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+        patterns.append(func.lower(Invoice.vendor).like("%" + escaped.replace(" ", "%") + "%", escape="!"))
+    return or_(*patterns)
+
+def _apply_purchase(row, unit_price, quantity, date):
+    """
+    Suma una compra a la celda. La media reciente se pliega en el orden en que llegan
+    las compras: refresh_keys la recalcula en orden de fecha.
+    """
+    row.price_ewma = unit_price if row.price_ewma is None else (
+        PRICE_EWMA_ALPHA * unit_price + (1 - PRICE_EWMA_ALPHA) * row.price_ewma
+    )
+    row.price_sum = (row.price_sum or 0.0) + unit_price
+    row.quantity_sum = (row.quantity_sum or 0.0) + quantity
+    row.purchases = (row.purchases or 0) + 1
+    if row.last_date is None or str(date) >= row.last_date:
+        row.last_price = unit_price
+        row.last_date = str(date)
+
+def record_purchase(db: Session, user_id, vendor, date, items):
+    """
+    Actualización incremental al guardar una factura nueva: O(1) por línea.
+    'items' son dicts con description / quantity / unit_price. No hace commit.
+    """
+    vendor = normalize_vendor(vendor)
+    if not vendor:
+        return
+    # La sesión no hace autoflush: dos líneas del mismo producto ("Tomate" / "tomate ")
+    # no verían la fila recién añadida por la otra y se insertaría dos veces
+    rows = {}
+    for item in items:
+        product = normalize_product(item.get("description"))
+        unit_price = item.get("unit_price")
+        if not product or unit_price is None or unit_price != unit_price:
+            continue
+        row = rows.get(product)
+        if row is None:
+            row = db.query(VendorPrice).filter(
+                VendorPrice.user_id == user_id, VendorPrice.product == product, VendorPrice.vendor == vendor
+            ).first()
+            if row is None:
+                row = VendorPrice(user_id=user_id, product=product, vendor=vendor)
+                db.add(row)
+            rows[product] = row
+        _apply_purchase(row, float(unit_price), float(item.get("quantity") or 0), date)
+
+def affected_keys(db: Session, user_id, invoice_ids=(), item_ids=()):
+    """
+    Claves (producto, proveedor) que tocan estas facturas/líneas. Llamar ANTES y
+    DESPUÉS de editar para cubrir tanto los valores antiguos como los nuevos.
+    """
+    if not invoice_ids and not item_ids:
+        return set()
+    query = db.query(InvoiceItem.description, Invoice.vendor)\
+        .join(Invoice, Invoice.id == InvoiceItem.invoice_id)\
+        .filter(InvoiceItem.user_id == user_id)
+    keys = set()
+    if invoice_ids:
+        keys |= {(normalize_product(d), normalize_vendor(v)) for d, v in query.filter(InvoiceItem.invoice_id.in_(list(invoice_ids)))}
+    if item_ids:
+        keys |= {(normalize_product(d), normalize_vendor(v)) for d, v in query.filter(InvoiceItem.id.in_(list(item_ids)))}
+    return keys
+
+def refresh_keys(db: Session, user_id, keys):
+    """
+    Recalcula solo las celdas afectadas por ediciones o borrados (no se pueden
+    deshacer de forma incremental: el 'último precio' puede cambiar). No hace commit.
+    """
+    keys = {(p, v) for p, v in keys if p and v}
+    if not keys:
+        return
+    vendors = {v for _, v in keys}
+    rows = db.query(InvoiceItem.description, InvoiceItem.unit_price, InvoiceItem.quantity, Invoice.vendor, Invoice.date)\
+        .join(Invoice, Invoice.id == InvoiceItem.invoice_id)\
+        .filter(InvoiceItem.user_id == user_id, _vendor_filter(vendors))\
+        .order_by(Invoice.date, InvoiceItem.id)\
+        .all()
+
+    fresh = {}
+    for description, unit_price, quantity, vendor, date in rows:
+        key = (normalize_product(description), normalize_vendor(vendor))
+        if key not in keys or unit_price is None:
+            continue
+        row = fresh.setdefault(key, VendorPrice(user_id=user_id, product=key[0], vendor=key[1]))
+        _apply_purchase(row, float(unit_price), float(quantity or 0), date)
+
+    existing = {
+        (r.product, r.vendor): r
+        for r in db.query(VendorPrice).filter(VendorPrice.user_id == user_id, VendorPrice.vendor.in_(list(vendors)))
+        if (r.product, r.vendor) in keys
+    }
+    for key in keys:
+        current, new = existing.get(key), fresh.get(key)
+        if new is None:
+            if current is not None:
+                db.delete(current)
+        elif current is None:
+            db.add(new)
+        else:
+            for attr in ("last_price", "last_date", "price_ewma", "price_sum", "quantity_sum", "purchases"):
+                setattr(current, attr, getattr(new, attr))
+
+def ensure_user_matrix(db: Session, user_id):
+    """
+    Construye la matriz de un usuario desde todo su histórico si aún no tiene la marca
+    de construida (datos anteriores a esta tabla). Que ya haya filas no basta: una subida
+    o edición previa crea solo las suyas. Devuelve True si la ha construido. No hace commit.
+    """
+    if db.query(VendorMatrixStatus.user_id).filter(VendorMatrixStatus.user_id == user_id).first():
+        return False
+    keys = {
+        (normalize_product(d), normalize_vendor(v))
+        for d, v in db.query(InvoiceItem.description, Invoice.vendor)
+        .join(Invoice, Invoice.id == InvoiceItem.invoice_id)
+        .filter(InvoiceItem.user_id == user_id)
+    }
+    # También las filas existentes, por si alguna ya no corresponde a ninguna línea
+    keys |= set(db.query(VendorPrice.product, VendorPrice.vendor).filter(VendorPrice.user_id == user_id))
+    refresh_keys(db, user_id, keys)
+    db.add(VendorMatrixStatus(user_id=user_id, built_at=datetime.now()))
+    return True
+
+def vendor_comparison(db: Session, user_id):
+    """
+    Por producto comprado a más de un proveedor: proveedor habitual (más compras),
+    proveedor más barato (último precio) y ahorro estimado. Lee solo de vendor_prices.
+    """
+    rows = db.query(VendorPrice).filter(VendorPrice.user_id == user_id).all()
+    by_product = defaultdict(list)
+    for r in rows:
+        if r.purchases and r.last_price is not None:
+            by_product[r.product].append(r)
+
+    data = []
+    for product, offers in by_product.items():
+        if len(offers) < 2:
+            continue
+        usual = max(offers, key=lambda r: (r.purchases, r.last_date or ""))
+        cheapest = min(offers, key=lambda r: r.last_price)
+        if cheapest.vendor == usual.vendor or not usual.last_price:
+            continue
+        diff = usual.last_price - cheapest.last_price
+        data.append({
+            "Producto": product,
+            "Proveedor Habitual": usual.vendor,
+            "Precio Habitual (€)": usual.last_price,
+            "Media Reciente (€)": usual.price_ewma if usual.price_ewma is not None else usual.last_price,
+            "Más Barato": cheapest.vendor,
+            "Precio Más Barato (€)": cheapest.last_price,
+            "Ahorro (%)": diff / usual.last_price * 100,
+            # Lo que se habría ahorrado comprando lo mismo al más barato
+            "Ahorro Estimado (€)": diff * (usual.quantity_sum or 0),
+        })
+    df = pd.DataFrame(data)
+    if not df.empty:
+        df = df.sort_values("Ahorro Estimado (€)", ascending=False)
+    return df
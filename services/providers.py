@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+
+# Proveedor de extracción usado por analyze_invoice / analyze_invoice_text.
+#   EXTRACTION_PROVIDER=gemini (por defecto) | replay
+#   EXTRACTION_MODEL=gemini-2.5-flash
+#   EXTRACTION_RECORD_PATH=grabacion.jsonl  -> graba peticiones y respuestas del proveedor real
+#   EXTRACTION_REPLAY_PATH=grabacion.jsonl  -> fichero que sirve el proveedor 'replay'
+#   EXTRACTION_REPLAY_LATENCY=recorded (por defecto) | sampled | none
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+def request_fingerprint(parts):
+    """
+    Huella estable de una petición: prompt(s) y documento(s), sin el modelo.
+    Así la misma factura se puede reproducir contra grabaciones de distintos modelos.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, dict):
+            h.update(part["mime_type"].encode())
+            h.update(part["data"])
+        else:
+            h.update(part.encode("utf-8"))
+    return h.hexdigest()
+
+class ExtractionProvider(ABC):
+    """
+    Interfaz mínima: generate(parts) recibe textos y blobs {"mime_type", "data"}
+    y devuelve el texto de la respuesta del modelo.
+    """
+    name = "base"
+    model = None
+
+    @abstractmethod
+    def generate(self, parts):
+        """Texto de la respuesta del modelo para estas partes."""
+
+class GeminiProvider(ExtractionProvider):
+    name = "gemini"
+
+    def __init__(self, model=DEFAULT_MODEL, api_key=None):
+        api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise RuntimeError("Falta la GOOGLE_API_KEY en los Secrets (.env).")
+
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model = model
+        self._model = genai.GenerativeModel(model)
+
+    def generate(self, parts):
+        return self._model.generate_content(parts).text
+
+class RecordingProvider(ExtractionProvider):
+    """Envuelve otro proveedor y añade cada petición/respuesta a un JSONL."""
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.name = f"record:{inner.name}"
+        self.model = inner.model
+        self.path = path
+        self._lock = threading.Lock()
+
+    def generate(self, parts):
+        started = time.perf_counter()
+        error = None
+        try:
+            text = self.inner.generate(parts)
+            return text
+        except Exception as e:
+            text, error = None, str(e)
+            raise
+        finally:
+            record = {
+                "fingerprint": request_fingerprint(parts),
+                "provider": self.inner.name,
+                "model": self.model,
+                "latency_ms": (time.perf_counter() - started) * 1000,
+                "response": text,
+                "error": error,
+            }
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+class ReplayProvider(ExtractionProvider):
+    """
+    Sirve respuestas grabadas por huella, sin red. Latencia:
+      'recorded' -> la que tuvo esa petición, 'sampled' -> muestreada de todas las
+      grabadas (distribución empírica), 'none' -> inmediata.
+    """
+    name = "replay"
+
+    def __init__(self, path, latency="recorded", seed=None):
+        self.path = path
+        self.latency = latency
+        self._random = random.Random(seed)
+        self.records = {}
+        self.latencies = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                self.records[record["fingerprint"]] = record
+                self.latencies.append(record["latency_ms"])
+                self.model = record.get("model")
+
+    def generate(self, parts):
+        record = self.records.get(request_fingerprint(parts))
+        if record is None:
+            raise KeyError("Petición no grabada en el fichero de replay.")
+
+        if self.latency == "recorded":
+            time.sleep(record["latency_ms"] / 1000)
+        elif self.latency == "sampled" and self.latencies:
+            time.sleep(self._random.choice(self.latencies) / 1000)
+
+        if record.get("error"):
+            raise RuntimeError(record["error"])
+        return record["response"]
+
+def build_provider(spec):
+    """
+    'gemini', 'gemini:gemini-2.5-pro' o 'replay:ruta.jsonl' -> proveedor.
+    Lo usan tanto la app (vía variables de entorno) como los benchmarks.
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "gemini":
+        return GeminiProvider(arg or os.getenv("EXTRACTION_MODEL", DEFAULT_MODEL))
+    if kind == "replay":
+        return ReplayProvider(arg or os.getenv("EXTRACTION_REPLAY_PATH"),
+                              latency=os.getenv("EXTRACTION_REPLAY_LATENCY", "recorded"))
+    raise ValueError(f"Proveedor de extracción desconocido: '{spec}'")
+
+_provider = None
+_provider_lock = threading.Lock()
+
+def get_provider():
+    """Proveedor configurado por entorno (uno por proceso)."""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            provider = build_provider(os.getenv("EXTRACTION_PROVIDER", "gemini"))
+            record_path = os.getenv("EXTRACTION_RECORD_PATH")
+            if record_path:
+                provider = RecordingProvider(provider, record_path)
+            _provider = provider
+        return _provider
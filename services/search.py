@@ -0,0 +1,145 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from database.search_indexes import PG_TSVECTOR
+
+PAGE_SIZE = 20
+
+PG_SEARCH_SQL = f"""
+WITH hits AS (
+    SELECT id AS invoice_id, vendor AS match, word_similarity(:q, vendor) AS score
+    FROM invoices
+    WHERE user_id = :user_id AND :q <% vendor
+    UNION ALL
+    SELECT invoice_id, description AS match,
+           GREATEST(word_similarity(:q, description),
+                    ts_rank({PG_TSVECTOR}, plainto_tsquery('spanish', :q))) AS score
+    FROM invoice_items
+    WHERE user_id = :user_id
+      AND (:q <% description OR {PG_TSVECTOR} @@ plainto_tsquery('spanish', :q))
+)
+SELECT i.id, i.vendor, i.date, i.total_amount, i.currency,
+       MAX(h.score) AS score,
+       (array_agg(h.match ORDER BY h.score DESC))[1] AS match
+FROM hits h
+JOIN invoices i ON i.id = h.invoice_id
+WHERE i.user_id = :user_id
+  AND (:date_from IS NULL OR i.date >= :date_from)
+  AND (:date_to IS NULL OR i.date <= :date_to)
+GROUP BY i.id, i.vendor, i.date, i.total_amount, i.currency
+ORDER BY score DESC, i.date DESC
+LIMIT :limit OFFSET :offset
+"""
+
+# bm25() devuelve valores negativos: cuanto menor, mejor. Lo invertimos para ordenar igual que en PG.
+SQLITE_SEARCH_SQL = """
+WITH hits AS (
+    SELECT rowid AS invoice_id, vendor AS match, -bm25(invoices_fts) AS score
+    FROM invoices_fts
+    WHERE invoices_fts MATCH :fts AND user_id = :user_id
+    UNION ALL
+    SELECT invoice_id, description AS match, -bm25(invoice_items_fts) AS score
+    FROM invoice_items_fts
+    WHERE invoice_items_fts MATCH :fts AND user_id = :user_id
+),
+best AS (
+    SELECT invoice_id, match, score,
+           ROW_NUMBER() OVER (PARTITION BY invoice_id ORDER BY score DESC) AS rn
+    FROM hits
+)
+SELECT i.id, i.vendor, i.date, i.total_amount, i.currency, b.score, b.match
+FROM best b
+JOIN invoices i ON i.id = b.invoice_id
+WHERE b.rn = 1 AND i.user_id = :user_id
+  AND (:date_from IS NULL OR i.date >= :date_from)
+  AND (:date_to IS NULL OR i.date <= :date_to)
+ORDER BY b.score DESC, i.date DESC
+LIMIT :limit OFFSET :offset
+"""
+
+# Respaldo para otros motores (MySQL, etc.): LIKE sin índices, pero SQL estándar.
+# Coincidir en el proveedor puntúa más que en la descripción de un producto.
+FALLBACK_SEARCH_SQL = """
+WITH hits AS (
+    SELECT id AS invoice_id, vendor AS match, 1.0 AS score
+    FROM invoices
+    WHERE user_id = :user_id AND LOWER(vendor) LIKE :pattern ESCAPE '!'
+    UNION ALL
+    SELECT invoice_id, description AS match, 0.5 AS score
+    FROM invoice_items
+    WHERE user_id = :user_id AND LOWER(description) LIKE :pattern ESCAPE '!'
+)
+SELECT i.id, i.vendor, i.date, i.total_amount, i.currency,
+       MAX(h.score) AS score, MIN(h.match) AS match
+FROM hits h
+JOIN invoices i ON i.id = h.invoice_id
+WHERE i.user_id = :user_id
+  AND (:date_from IS NULL OR i.date >= :date_from)
+  AND (:date_to IS NULL OR i.date <= :date_to)
+GROUP BY i.id, i.vendor, i.date, i.total_amount, i.currency
+ORDER BY score DESC, i.date DESC
+LIMIT :limit OFFSET :offset
+"""
+
+def _like_pattern(query):
+    """Patrón '%texto%' en minúsculas, escapando los comodines que escriba el usuario."""
+    # '!' como carácter de escape: la barra invertida no es portable (MySQL la interpreta)
+    escaped = query.lower().replace("!", "!!").replace("%", "!%").replace("_", "!_")
+    return f"%{escaped}%"
+
+def _fts5_query(query):
+    """
+    Convierte texto libre en una consulta FTS5 segura: cada palabra entre comillas
+    (sin operadores) y unidas con AND implícito. El tokenizer trigram necesita >= 3 letras.
+    """
+    terms = [t.replace('"', '') for t in query.split()]
+    terms = [t for t in terms if len(t) >= 3]
+    return " ".join(f'"{t}"' for t in terms)
+
+def search_invoices(db: Session, user_id: str, query: str, page: int = 0,
+                    page_size: int = PAGE_SIZE, date_from=None, date_to=None):
+    """
+    Busca facturas del usuario por proveedor o por descripción de sus productos.
+    Devuelve (resultados, hay_mas). Cada resultado es un dict con la factura,
+    el texto que ha coincidido ('match') y su puntuación ('score').
+    """
+    query = (query or "").strip()
+    if not query:
+        return [], False
+
+    params = {
+        "user_id": user_id,
+        "date_from": str(date_from) if date_from else None,
+        "date_to": str(date_to) if date_to else None,
+        # Pedimos uno de más para saber si hay página siguiente sin hacer COUNT(*)
+        "limit": page_size + 1,
+        "offset": page * page_size,
+    }
+
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        sql = PG_SEARCH_SQL
+        params["q"] = query
+    elif dialect == "sqlite":
+        fts = _fts5_query(query)
+        if not fts:
+            return [], False
+        sql = SQLITE_SEARCH_SQL
+        params["fts"] = fts
+    else:
+        sql = FALLBACK_SEARCH_SQL
+        params["pattern"] = _like_pattern(query)
+
+    rows = db.execute(text(sql), params).mappings().all()
+    hits = [
+        {
+            "invoice_id": r["id"],
+            "vendor": r["vendor"],
+            "date": r["date"],
+            "total_amount": r["total_amount"],
+            "currency": r["currency"],
+            "match": r["match"],
+            "score": float(r["score"] or 0),
+        }
+        for r in rows[:page_size]
+    ]
+    return hits, len(rows) > page_size
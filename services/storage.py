@@ -0,0 +1,145 @@
+import hashlib
+import io
+import os
+import tempfile
+from PIL import Image, ImageOps
+
+# Almacén de documentos direccionado por contenido: la clave es el SHA-256 del fichero,
+# así que subir dos veces el mismo documento no ocupa el doble.
+# STORAGE_BACKEND=local (por defecto, en STORAGE_DIR) o s3 (S3_BUCKET, S3_ENDPOINT_URL
+# opcional para MinIO u otro compatible; credenciales por las variables estándar de AWS).
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+STORAGE_DIR = os.getenv("STORAGE_DIR", "storage")
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+
+THUMBNAIL_SIZE = (320, 320)
+
+EXTENSIONS = {
+    "application/pdf": "pdf",
+    "image/jpeg": "jpg",
+    "image/jpg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+}
+# Al revés, para servir la descarga con un Content-Type válido (el primero gana: image/jpeg)
+MIME_TYPES = {}
+for _mime, _ext in EXTENSIONS.items():
+    MIME_TYPES.setdefault(_ext, _mime)
+
+class StorageError(Exception):
+    """El almacén de documentos no está disponible (S3/MinIO caído, disco lleno, mal configurado)."""
+
+class LocalBlobStore:
+    """Ficheros en disco repartidos en subcarpetas por los 2 primeros caracteres del hash."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        folder, name = os.path.split(key)
+        return os.path.join(self.root, folder, name[:2], name)
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, key, data, content_type=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Escritura atómica: nunca queda un fichero a medias con la clave definitiva
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, key):
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+class S3BlobStore:
+    """Cualquier almacén compatible con S3 (AWS, MinIO, R2...). Requiere boto3."""
+
+    def __init__(self, bucket, endpoint_url=None):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 requiere instalar boto3 (pip install boto3).")
+        self.bucket = bucket
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError:
+            return False
+
+    def put(self, key, data, content_type=None):
+        extra = {"ContentType": content_type} if content_type else {}
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, **extra)
+
+    def get(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+_store = None
+
+def get_store():
+    global _store
+    if _store is None:
+        if STORAGE_BACKEND == "s3":
+            if not S3_BUCKET:
+                raise ValueError("STORAGE_BACKEND=s3 necesita la variable S3_BUCKET.")
+            _store = S3BlobStore(S3_BUCKET, S3_ENDPOINT_URL)
+        else:
+            _store = LocalBlobStore(STORAGE_DIR)
+    return _store
+
+def thumbnail_key(document_key):
+    return f"thumbs/{document_key.split('.')[0]}.webp"
+
+def make_thumbnail(bytes_data):
+    """Miniatura WebP (máx. THUMBNAIL_SIZE). None si el documento no es una imagen."""
+    try:
+        img = Image.open(io.BytesIO(bytes_data))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail(THUMBNAIL_SIZE)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB")
+        out = io.BytesIO()
+        img.save(out, "WEBP", quality=75)
+        return out.getvalue()
+    except Exception:
+        return None
+
+def save_document(bytes_data, mime_type, sha256=None):
+    """
+    Guarda el original y, si es una imagen, su miniatura (una sola vez por contenido).
+    Devuelve la clave del documento, que se guarda en Invoice.image_url.
+    """
+    sha256 = sha256 or hashlib.sha256(bytes_data).hexdigest()
+    key = f"{sha256}.{EXTENSIONS.get(mime_type, 'bin')}"
+
+    try:
+        store = get_store()
+        if not store.exists(key):
+            store.put(key, bytes_data, mime_type)
+            thumb = make_thumbnail(bytes_data)
+            if thumb:
+                store.put(thumbnail_key(key), thumb, "image/webp")
+    except Exception as e:
+        raise StorageError(f"No se pudo guardar el documento original: {e}") from e
+    return key
+
+def load_thumbnail(document_key):
+    """Bytes de la miniatura WebP o None (PDFs, o documento sin miniatura)."""
+    store = get_store()
+    key = thumbnail_key(document_key)
+    return store.get(key) if store.exists(key) else None
+
+def load_document(document_key):
+    return get_store().get(document_key)
+
+def document_mime_type(document_key):
+    """Content-Type a partir de la extensión de la clave ('application/octet-stream' si no se conoce)."""
+    return MIME_TYPES.get(document_key.rsplit(".", 1)[-1].lower(), "application/octet-stream")
@@ -0,0 +1,61 @@
+import random
+
+from database.models import DocumentFingerprint, Invoice
+from services import duplicates
+from services.duplicates import BKTree, find_duplicate_uploads, hamming, save_fingerprint
+
+def _invoice(db, user_id="u"):
+    invoice = Invoice(user_id=user_id, vendor="Makro", date="2026-01-15", total_amount=10.0, currency="EUR")
+    db.add(invoice)
+    db.flush()
+    return invoice
+
+def test_bktree_search_matches_brute_force():
+    rng = random.Random(7)
+    values = [rng.getrandbits(64) for _ in range(300)]
+    # Algunos casi iguales a otros para que haya aciertos dentro del radio
+    values += [v ^ (1 << rng.randrange(64)) for v in values[:50]]
+    tree = BKTree()
+    for i, v in enumerate(values):
+        tree.add(v, i)
+
+    for query in values[:20] + [rng.getrandbits(64) for _ in range(20)]:
+        expected = sorted((hamming(query, v), i) for i, v in enumerate(values) if hamming(query, v) <= 10)
+        assert sorted(tree.search(query, 10)) == expected
+
+def test_bktree_groups_identical_hashes():
+    tree = BKTree()
+    tree.add(0, "a")
+    tree.add(0, "b")
+    assert tree.size == 2
+    assert sorted(tree.search(1, 1)) == [(1, "a"), (1, "b")]
+    assert BKTree().search(0, 10) == []
+
+def test_find_duplicate_uploads_after_delete_then_add(db):
+    duplicates._trees.clear()
+    viejo = _invoice(db)
+    save_fingerprint(db, "u", viejo.id, "ffffffffffffffff", "a")
+    db.commit()
+    assert [inv.id for _, inv in find_duplicate_uploads(db, "u", "fffffffffffffffe", "x")] == [viejo.id]
+
+    # Borrado desde el historial y una subida nueva antes de la siguiente búsqueda:
+    # el número de huellas no cambia, pero el conjunto sí
+    db.query(DocumentFingerprint).filter(DocumentFingerprint.invoice_id == viejo.id).delete()
+    db.delete(viejo)
+    nuevo = _invoice(db)
+    save_fingerprint(db, "u", nuevo.id, "0000000000000000", "b")
+    db.commit()
+
+    resultado = find_duplicate_uploads(db, "u", "0000000000000001", "x")
+    assert [(d, inv.id) for d, inv in resultado] == [(1, nuevo.id)]
+
+def test_find_duplicate_uploads_exact_and_per_user(db):
+    duplicates._trees.clear()
+    mia = _invoice(db, "u")
+    ajena = _invoice(db, "otro")
+    save_fingerprint(db, "u", mia.id, None, "pdf-sha")
+    save_fingerprint(db, "otro", ajena.id, "0000000000000000", "otro-sha")
+    db.commit()
+
+    assert [(d, inv.id) for d, inv in find_duplicate_uploads(db, "u", None, "pdf-sha")] == [(0, mia.id)]
+    assert find_duplicate_uploads(db, "u", "0000000000000000", "x") == []
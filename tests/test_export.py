@@ -0,0 +1,36 @@
+import csv
+
+import pytest
+
+from database.models import Invoice, InvoiceItem
+from services import export
+from services.export import EXPORT_COLUMNS, export_invoices, read_export
+
+def _seed(db):
+    invoice = Invoice(user_id="u", vendor="Makro", date="2026-01-15", total_amount=10.0, currency="EUR")
+    db.add(invoice)
+    db.flush()
+    db.add(InvoiceItem(invoice_id=invoice.id, user_id="u", date="2026-01-15", description="Sal",
+                       quantity=2, unit_price=5.0, total_price=10.0))
+    db.commit()
+
+def test_export_csv_round_trip(db):
+    _seed(db)
+    path, mime, count = export_invoices(db, "u", "2026-01-01", "2026-01-31", "csv")
+    try:
+        assert (mime, count) == ("text/csv", 1)
+        rows = list(csv.reader(read_export(path).decode("utf-8-sig").splitlines(), delimiter=";"))
+        assert rows[0] == EXPORT_COLUMNS
+    finally:
+        export.os.remove(path)
+
+def test_export_over_size_limit_is_rejected_and_removed(db, monkeypatch):
+    _seed(db)
+    monkeypatch.setattr(export, "EXPORT_MAX_BYTES", 10)
+    antes = set(export.glob.glob(export.os.path.join(export.tempfile.gettempdir(), f"{export.EXPORT_PREFIX}*")))
+
+    with pytest.raises(ValueError):
+        export_invoices(db, "u", "2026-01-01", "2026-01-31", "csv")
+
+    despues = set(export.glob.glob(export.os.path.join(export.tempfile.gettempdir(), f"{export.EXPORT_PREFIX}*")))
+    assert despues <= antes
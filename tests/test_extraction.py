@@ -0,0 +1,113 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from database.models import VendorTemplate
+from services import extraction
+from services.extraction import (
+    EXTRACTION_ERROR, MAX_TEMPLATE_MISSES, TIER_DOCUMENT, TIER_TEMPLATE,
+    apply_template, confirm_extraction, learn_template, parse_number,
+)
+
+TEXT = """MAKRO CASH & CARRY ESPAÑA
+Factura nº 2026/0042 Fecha: 15/01/2026
+Cliente: Restaurante Ejemplo S.L.
+Aceite oliva virgen 5L 2 25,50 51,00
+Harina trigo 25kg 1 18,00 18,00
+Tomate triturado 3kg 6 3,20 19,20
+Base imponible 88,20
+Total factura: 97,02 €
+"""
+
+CONFIRMED = {
+    "vendor": "Makro",
+    "date": "2026-01-15",
+    "currency": "EUR",
+    "total_amount": 97.02,
+    "items": [
+        {"description": "Aceite oliva virgen 5L", "quantity": 2, "unit_price": 25.5, "total": 51.0},
+        {"description": "Harina trigo 25kg", "quantity": 1, "unit_price": 18.0, "total": 18.0},
+        {"description": "Tomate triturado 3kg", "quantity": 6, "unit_price": 3.2, "total": 19.2},
+    ],
+}
+
+@pytest.mark.parametrize("raw, expected", [
+    ("1.234,56", 1234.56),
+    ("1,234.56", 1234.56),
+    ("12,5", 12.5),
+    ("12.5", 12.5),
+    (" 7 ", 7.0),
+    ("-3,20", -3.2),
+    ("abc", None),
+])
+def test_parse_number(raw, expected):
+    assert parse_number(raw) == expected
+
+def test_learn_template_labels_and_columns():
+    template = learn_template(TEXT, CONFIRMED)
+    assert template["vendor"] == "Makro"
+    assert template["date_label"] == "Fecha"
+    assert template["date_format"] == "%d/%m/%Y"
+    assert template["total_label"] == "Total factura"
+    assert template["item_columns"] == ["quantity", "unit_price", "total"]
+
+def test_learn_template_rejects_other_vendor_or_bad_date():
+    assert learn_template(TEXT, dict(CONFIRMED, vendor="Mercadona")) is None
+    assert learn_template(TEXT, dict(CONFIRMED, date="15/01/2026")) is None
+
+def test_apply_template_round_trip_on_new_invoice():
+    template = learn_template(TEXT, CONFIRMED)
+    nueva = (TEXT.replace("15/01/2026", "03/02/2026")
+             .replace("Harina trigo 25kg 1 18,00 18,00", "Harina trigo 25kg 2 18,00 36,00")
+             .replace("88,20", "106,20").replace("97,02", "116,82"))
+
+    datos = apply_template(nueva, template)
+    assert datos["vendor"] == "Makro"
+    assert datos["date"] == "2026-02-03"
+    assert datos["total_amount"] == 116.82
+    assert [(i["description"], i["quantity"], i["total"]) for i in datos["items"]] == [
+        ("Aceite oliva virgen 5L", 2, 51.0),
+        ("Harina trigo 25kg", 2, 36.0),
+        ("Tomate triturado 3kg", 6, 19.2),
+    ]
+
+def test_apply_template_rejects_incoherent_totals_and_other_documents():
+    template = learn_template(TEXT, CONFIRMED)
+    assert apply_template(TEXT.replace("97,02", "970,20"), template) is None
+    assert apply_template(TEXT.replace("MAKRO", "OTRO"), template) is None
+
+def _template_row(db, **counters):
+    row = VendorTemplate(user_id="u", vendor="Makro", template=json.dumps(learn_template(TEXT, CONFIRMED)), **counters)
+    db.add(row)
+    db.commit()
+    return row
+
+def test_confirm_extraction_counts_hit(db):
+    row = _template_row(db, hits=0, misses=0)
+    confirm_extraction(db, "u", TEXT, TIER_TEMPLATE, apply_template(TEXT, json.loads(row.template)), CONFIRMED)
+    db.commit()
+    assert (row.hits, row.misses) == (1, 0)
+
+def test_confirm_extraction_counts_miss_even_if_not_relearnable(db):
+    row = _template_row(db, hits=0, misses=MAX_TEMPLATE_MISSES - 1)
+    extracted = apply_template(TEXT, json.loads(row.template))
+    # El usuario corrige tanto que ya no se puede re-aprender (la fecha no está en el texto)
+    corrected = dict(CONFIRMED, date="2026-01-20", total_amount=120.0)
+    assert learn_template(TEXT, corrected) is None
+
+    confirm_extraction(db, "u", TEXT, TIER_TEMPLATE, extracted, corrected)
+    db.commit()
+    assert (row.hits, row.misses) == (0, MAX_TEMPLATE_MISSES)
+
+def test_extract_invoice_counts_ai_errors_separately(db, monkeypatch):
+    monkeypatch.setattr(extraction, "_stats", extraction.Counter())
+    monkeypatch.setattr(extraction, "analyze_invoice", lambda uploaded_file: {"error": "fallo"})
+    upload = SimpleNamespace(type="image/jpeg", getvalue=lambda: b"")
+
+    datos, tier, _ = extraction.extract_invoice(db, "u", upload)
+
+    assert "error" in datos and tier == TIER_DOCUMENT
+    stats = {s["tier"]: s["count"] for s in extraction.tier_stats()}
+    assert stats[TIER_DOCUMENT] == 0
+    assert stats[EXTRACTION_ERROR] == 1
@@ -0,0 +1,100 @@
+import math
+
+import pytest
+
+from database.models import Invoice, InvoiceItem, VendorPrice
+from services.history_batch import INVOICE_COLUMNS, ITEM_COLUMNS, apply_history_diff, check_date, compute_diff
+
+def _invoice(db, lines, user_id="u", vendor="Makro", date="2026-01-15"):
+    invoice = Invoice(user_id=user_id, vendor=vendor, date=date, currency="EUR",
+                      total_amount=sum(q * p for _, q, p in lines))
+    db.add(invoice)
+    db.flush()
+    items = []
+    for description, quantity, unit_price in lines:
+        item = InvoiceItem(invoice_id=invoice.id, user_id=user_id, date=date, description=description,
+                           quantity=quantity, unit_price=unit_price, total_price=quantity * unit_price)
+        db.add(item)
+        items.append(item)
+    db.commit()
+    return invoice, items
+
+@pytest.mark.parametrize("value", ["2026-1-5", "05/01/2026", "2026-02-30", "", None, "2026-01-05 10:00"])
+def test_check_date_rejects_non_iso(value):
+    with pytest.raises(ValueError):
+        check_date(value)
+
+def test_check_date_accepts_iso():
+    check_date("2026-01-05")
+
+def test_compute_diff_only_changed_columns():
+    original = [{"id": 1, "vendor": "Makro", "date": "2026-01-15", "total_amount": 10.0, "currency": "EUR"}]
+    edited = [{"id": 1, "vendor": "Mercadona", "date": "2026-01-15", "total_amount": 10.0, "currency": "EUR"}]
+    assert compute_diff(original, edited, INVOICE_COLUMNS) == ({1: {"vendor": "Mercadona"}}, [])
+
+def test_compute_diff_nan_equals_none():
+    original = [{"id": 1, "description": "Sal", "quantity": None, "unit_price": 1.0, "total_price": None}]
+    edited = [{"id": 1, "description": "Sal", "quantity": math.nan, "unit_price": 1.0, "total_price": math.nan}]
+    assert compute_diff(original, edited, ITEM_COLUMNS) == ({}, [])
+
+    # Vaciar una celda se guarda como NULL, no como NaN
+    edited[0]["unit_price"] = math.nan
+    assert compute_diff(original, edited, ITEM_COLUMNS) == ({1: {"unit_price": None}}, [])
+
+def test_compute_diff_delete_flag_and_unknown_rows():
+    original = [{"id": 1, "description": "Sal", "quantity": 1, "unit_price": 1.0, "total_price": 1.0}]
+    edited = [
+        dict(original[0], description="Sal fina", delete=True),
+        {"id": 99, "description": "Nueva", "quantity": 1, "unit_price": 1.0, "total_price": 1.0},
+    ]
+    # Marcada para borrar: no se actualiza. Filas que no estaban: se ignoran
+    assert compute_diff(original, edited, ITEM_COLUMNS) == ({}, [1])
+
+def test_apply_history_diff_recomputes_lines_and_invoice_total(db):
+    invoice, (a, b) = _invoice(db, [("Tomate", 1, 5.0), ("Cebolla", 1, 5.0)])
+    invoice_id, a_id, b_id = invoice.id, a.id, b.id
+
+    resumen = apply_history_diff(db, "u", {}, [], {b_id: {"quantity": 3}}, [a_id])
+
+    assert resumen["invoices_retotaled"] == 1
+    db.expunge_all()
+    assert db.get(InvoiceItem, b_id).total_price == 15.0
+    assert db.get(InvoiceItem, a_id) is None
+    assert db.get(Invoice, invoice_id).total_amount == 15.0
+
+def test_apply_history_diff_keeps_explicit_total(db):
+    invoice, (a,) = _invoice(db, [("Tomate", 2, 5.0)])
+
+    apply_history_diff(db, "u", {invoice.id: {"total_amount": 12.1}}, [], {a.id: {"unit_price": 6.0}}, [])
+
+    db.expire_all()
+    assert db.get(InvoiceItem, a.id).total_price == 12.0
+    assert db.get(Invoice, invoice.id).total_amount == 12.1
+
+def test_apply_history_diff_syncs_dates_and_price_matrix(db):
+    invoice, (a,) = _invoice(db, [("Tomate", 1, 5.0)])
+
+    apply_history_diff(db, "u", {invoice.id: {"date": "2026-02-01", "vendor": "Mercadona"}}, [], {}, [])
+
+    db.expire_all()
+    assert db.get(InvoiceItem, a.id).date == "2026-02-01"
+    rows = db.query(VendorPrice).filter(VendorPrice.user_id == "u").all()
+    assert [(r.product, r.vendor, r.last_date) for r in rows] == [("tomate", "mercadona", "2026-02-01")]
+
+def test_apply_history_diff_rejects_bad_date_without_changes(db):
+    invoice, _ = _invoice(db, [("Tomate", 1, 5.0)])
+
+    with pytest.raises(ValueError):
+        apply_history_diff(db, "u", {invoice.id: {"date": "15/01/2026", "vendor": "Otro"}}, [], {}, [])
+
+    db.expire_all()
+    assert db.get(Invoice, invoice.id).vendor == "Makro"
+
+def test_apply_history_diff_ignores_other_users(db):
+    ajena, (linea,) = _invoice(db, [("Tomate", 1, 5.0)], user_id="otro")
+
+    apply_history_diff(db, "u", {ajena.id: {"vendor": "Hack"}}, [], {}, [linea.id])
+
+    db.expire_all()
+    assert db.get(Invoice, ajena.id).vendor == "Makro"
+    assert db.get(InvoiceItem, linea.id) is not None
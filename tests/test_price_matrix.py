@@ -0,0 +1,93 @@
+import pytest
+
+from database.models import Invoice, InvoiceItem, VendorPrice
+from services.price_matrix import PRICE_EWMA_ALPHA, ensure_user_matrix, record_purchase
+
+def _add_invoice(db, user_id, vendor, date, items):
+    invoice = Invoice(user_id=user_id, vendor=vendor, date=date, total_amount=0, currency="EUR")
+    db.add(invoice)
+    db.flush()
+    for description, quantity, unit_price in items:
+        db.add(InvoiceItem(
+            invoice_id=invoice.id, user_id=user_id, date=date, description=description,
+            quantity=quantity, unit_price=unit_price, total_price=quantity * unit_price,
+        ))
+    return invoice
+
+def test_record_purchase_same_product_twice_in_one_invoice(db):
+    items = [
+        {"description": "Tomate", "quantity": 2, "unit_price": 1.5},
+        {"description": "tomate ", "quantity": 3, "unit_price": 1.2},
+    ]
+    record_purchase(db, "u1", "Makro", "2026-01-15", items)
+    db.commit()
+
+    rows = db.query(VendorPrice).filter(VendorPrice.user_id == "u1").all()
+    assert len(rows) == 1
+    row = rows[0]
+    assert row.product == "tomate"
+    assert row.purchases == 2
+    assert row.quantity_sum == 5
+    assert row.last_price == 1.2
+
+def test_record_purchase_accumulates_existing_row(db):
+    record_purchase(db, "u1", "Makro", "2026-01-15", [{"description": "Harina", "quantity": 1, "unit_price": 18.0}])
+    db.commit()
+    record_purchase(db, "u1", "Makro", "2026-02-01", [{"description": "HARINA", "quantity": 1, "unit_price": 17.0}])
+    db.commit()
+
+    row = db.query(VendorPrice).filter(VendorPrice.user_id == "u1").one()
+    assert row.purchases == 2
+    assert row.last_price == 17.0
+    assert row.last_date == "2026-02-01"
+
+def test_ensure_user_matrix_backfills_after_earlier_upload(db):
+    # Histórico anterior a la matriz: facturas sin filas en vendor_prices
+    _add_invoice(db, "u1", "Makro", "2025-11-03", [("Aceite", 1, 25.0)])
+    _add_invoice(db, "u1", "Mercadona", "2025-12-10", [("Aceite", 1, 22.0)])
+    db.commit()
+
+    # Una subida antes de la primera visita al dashboard crea solo su fila
+    _add_invoice(db, "u1", "Makro", "2026-01-15", [("Harina", 1, 18.0)])
+    record_purchase(db, "u1", "Makro", "2026-01-15", [{"description": "Harina", "quantity": 1, "unit_price": 18.0}])
+    db.commit()
+
+    assert ensure_user_matrix(db, "u1") is True
+    db.commit()
+    keys = {(r.product, r.vendor): r.purchases for r in db.query(VendorPrice).filter(VendorPrice.user_id == "u1")}
+    assert keys == {("aceite", "makro"): 1, ("aceite", "mercadona"): 1, ("harina", "makro"): 1}
+
+    # Ya construida: no se vuelve a recorrer el histórico
+    assert ensure_user_matrix(db, "u1") is False
+
+def test_vendor_key_is_normalized(db):
+    record_purchase(db, "u1", "Makro", "2026-01-15", [{"description": "Sal", "quantity": 1, "unit_price": 1.0}])
+    db.commit()
+    record_purchase(db, "u1", "  MAKRO ", "2026-01-20", [{"description": "Sal", "quantity": 1, "unit_price": 1.1}])
+    db.commit()
+
+    row = db.query(VendorPrice).filter(VendorPrice.user_id == "u1").one()
+    assert (row.vendor, row.purchases) == ("makro", 2)
+
+def test_recent_average_weights_latest_purchases(db):
+    # Precio viejo muy alto y varios recientes bajos: la media reciente se acerca a los recientes
+    for i, price in enumerate([10.0, 2.0, 2.0, 2.0, 2.0, 2.0]):
+        record_purchase(db, "u1", "Makro", f"2026-01-{10 + i}", [{"description": "Sal", "quantity": 1, "unit_price": price}])
+        db.commit()
+
+    row = db.query(VendorPrice).filter(VendorPrice.user_id == "u1").one()
+    assert row.price_sum / row.purchases > 3.3
+    assert row.price_ewma == pytest.approx(2.0 + 8.0 * (1 - PRICE_EWMA_ALPHA) ** 5)
+
+def test_refresh_rebuilds_recent_average_in_date_order(db):
+    # Guardadas fuera de orden: la reconstrucción las pliega por fecha
+    _add_invoice(db, "u1", "Makro", "2026-03-01", [("Sal", 1, 2.0)])
+    _add_invoice(db, "u1", "MAKRO", "2026-01-01", [("Sal", 1, 10.0)])
+    db.commit()
+
+    assert ensure_user_matrix(db, "u1") is True
+    db.commit()
+    row = db.query(VendorPrice).filter(VendorPrice.user_id == "u1").one()
+    assert row.vendor == "makro"
+    assert row.last_price == 2.0
+    assert row.price_ewma == pytest.approx(PRICE_EWMA_ALPHA * 2.0 + (1 - PRICE_EWMA_ALPHA) * 10.0)
@@ -0,0 +1,76 @@
+import json
+import time
+
+import pytest
+
+from services.providers import (
+    ExtractionProvider, RecordingProvider, ReplayProvider, build_provider, request_fingerprint,
+)
+
+FACTURA = ["Extrae la factura", {"mime_type": "image/png", "data": b"\x89PNG factura"}]
+ROTA = ["Extrae la factura", {"mime_type": "image/png", "data": b"\x89PNG rota"}]
+
+class FakeProvider(ExtractionProvider):
+    name = "fake"
+    model = "fake-1"
+
+    def generate(self, parts):
+        if parts[1]["data"].endswith(b"rota"):
+            raise RuntimeError("Cuota agotada")
+        time.sleep(0.02)
+        return '{"vendor": "Makro"}'
+
+def test_provider_interface_is_abstract():
+    with pytest.raises(TypeError):
+        ExtractionProvider()
+
+def test_request_fingerprint_depends_on_content():
+    assert request_fingerprint(FACTURA) == request_fingerprint(list(FACTURA))
+    assert request_fingerprint(FACTURA) != request_fingerprint(ROTA)
+    assert request_fingerprint(["a", "b"]) != request_fingerprint(["b", "a"])
+
+def test_record_then_replay_round_trip(tmp_path):
+    path = str(tmp_path / "grabacion.jsonl")
+    recorder = RecordingProvider(FakeProvider(), path)
+    assert recorder.generate(FACTURA) == '{"vendor": "Makro"}'
+    with pytest.raises(RuntimeError):
+        recorder.generate(ROTA)
+
+    records = [json.loads(line) for line in open(path, encoding="utf-8")]
+    assert [r["fingerprint"] for r in records] == [request_fingerprint(FACTURA), request_fingerprint(ROTA)]
+    assert records[0]["model"] == "fake-1" and records[0]["latency_ms"] >= 20
+
+    replay = ReplayProvider(path, latency="none")
+    assert replay.model == "fake-1"
+    started = time.perf_counter()
+    # Determinista: la misma petición siempre da la misma respuesta, sin red ni espera
+    assert [replay.generate(FACTURA) for _ in range(3)] == ['{"vendor": "Makro"}'] * 3
+    assert time.perf_counter() - started < 0.02
+
+    # Los errores grabados se reproducen como errores
+    with pytest.raises(RuntimeError, match="Cuota agotada"):
+        replay.generate(ROTA)
+
+    # Una petición que no se grabó no se inventa
+    with pytest.raises(KeyError):
+        replay.generate(["Otra petición"])
+
+def test_replay_recorded_latency(tmp_path):
+    path = tmp_path / "grabacion.jsonl"
+    path.write_text(json.dumps({
+        "fingerprint": request_fingerprint(FACTURA), "provider": "fake", "model": "fake-1",
+        "latency_ms": 50, "response": "ok", "error": None,
+    }) + "\n", encoding="utf-8")
+
+    started = time.perf_counter()
+    assert ReplayProvider(str(path), latency="recorded").generate(FACTURA) == "ok"
+    assert time.perf_counter() - started >= 0.05
+
+def test_build_provider_replay_and_unknown(tmp_path, monkeypatch):
+    path = tmp_path / "vacia.jsonl"
+    path.write_text("", encoding="utf-8")
+    monkeypatch.setenv("EXTRACTION_REPLAY_LATENCY", "none")
+    provider = build_provider(f"replay:{path}")
+    assert isinstance(provider, ReplayProvider) and provider.latency == "none"
+    with pytest.raises(ValueError):
+        build_provider("otro")
@@ -0,0 +1,30 @@
+import pytest
+
+from services import storage
+from services.storage import StorageError, document_mime_type, save_document
+
+@pytest.mark.parametrize("key, mime", [
+    ("abc.pdf", "application/pdf"),
+    ("abc.jpg", "image/jpeg"),
+    ("abc.PNG", "image/png"),
+    ("abc.webp", "image/webp"),
+    ("abc.bin", "application/octet-stream"),
+])
+def test_document_mime_type(key, mime):
+    assert document_mime_type(key) == mime
+
+def test_save_document_is_content_addressed(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "get_store", lambda: storage.LocalBlobStore(str(tmp_path)))
+    key = save_document(b"%PDF-1.4 factura", "application/pdf")
+    assert key.endswith(".pdf")
+    assert save_document(b"%PDF-1.4 factura", "application/pdf") == key
+    assert storage.load_document(key) == b"%PDF-1.4 factura"
+
+def test_save_document_wraps_backend_errors(monkeypatch):
+    class Caido:
+        def exists(self, key):
+            raise ConnectionError("endpoint no disponible")
+
+    monkeypatch.setattr(storage, "get_store", lambda: Caido())
+    with pytest.raises(StorageError):
+        save_document(b"x", "image/png")
@@ -1,23 +1,49 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
+from contextlib import contextmanager
 from datetime import datetime, time, timedelta
-from database.connection import get_db_session
+from time import perf_counter
+from database.connection import get_db_session, get_read_session
+from services.price_matrix import ensure_user_matrix, vendor_comparison
+from services.data_version import get_data_version
 from database.models import Invoice, InvoiceItem
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
 
-def load_data():
+# La clave de la caché ya cambia con cada escritura; el TTL solo libera memoria
+DATA_TTL_SECONDS = 300
+
+@contextmanager
+def measure(section):
     """
-    Carga facturas e ítems de la BD filtrando por el USUARIO ACTUAL.
+    Cuenta ejecuciones y tiempo de cada sección (por sesión) para comprobar
+    que interactuar con un fragmento solo re-ejecuta ese fragmento.
     """
-    db = get_db_session()
+    started = perf_counter()
     try:
-        # Verificamos que el usuario esté en sesión para evitar crash
-        if 'user' not in st.session_state:
-            return pd.DataFrame(), pd.DataFrame()
+        yield
+    finally:
+        metrics = st.session_state.setdefault("dashboard_metrics", {})
+        m = metrics.setdefault(section, {"runs": 0, "last_ms": 0.0, "total_ms": 0.0})
+        m["runs"] += 1
+        m["last_ms"] = (perf_counter() - started) * 1000
+        m["total_ms"] += m["last_ms"]
+        if st.session_state.get("show_dashboard_metrics"):
+            st.caption(
+                f"⏱️ {section}: {m['runs']} ejecuciones · última {m['last_ms']:.0f} ms "
+                f"· media {m['total_ms'] / m['runs']:.0f} ms"
+            )
 
-        current_user_id = st.session_state.user.id
-        
+@st.cache_data(ttl=DATA_TTL_SECONDS, show_spinner=False)
+def _load_data_cached(current_user_id, data_version, _last_write_at):
+    """
+    Consulta cacheada por (usuario, versión de sus datos en BD). Cualquier escritura,
+    desde cualquier sesión, cambia la versión. '_last_write_at' no entra en la clave
+    (prefijo '_'): solo decide si se lee del primario o de la réplica.
+    """
+    db = get_db_session(read_only=True, last_write_at=_last_write_at)
+    try:
         # Usamos joinedload para traer los items en la misma consulta (Eficiencia)
         invoices = db.query(Invoice)\
             .filter(Invoice.user_id == current_user_id)\
@@ -61,20 +87,214 @@ def load_data():
         df_items = pd.DataFrame(data_items)
 
         return df_invoices, df_items
+    finally:
+        db.close()
+
+def load_data():
+    """
+    Carga facturas e ítems de la BD filtrando por el USUARIO ACTUAL.
+    """
+    # Verificamos que el usuario esté en sesión para evitar crash
+    if 'user' not in st.session_state:
+        return pd.DataFrame(), pd.DataFrame()
+
+    try:
+        user_id = st.session_state.user.id
+        # La versión se lee del mismo origen (primario o réplica) que luego servirá los datos
+        db = get_read_session(st.session_state)
+        try:
+            data_version = get_data_version(db, user_id)
+        finally:
+            db.close()
+        return _load_data_cached(user_id, data_version, st.session_state.get("db_last_write_at"))
     except Exception as e:
         st.error(f"Error cargando datos: {e}")
         return pd.DataFrame(), pd.DataFrame()
-    finally:
-        db.close()
+
+@st.fragment
+def render_product_analysis(df_items_filtered):
+    """Fragmento: depende solo de los ítems del periodo filtrado."""
+    with measure("Análisis de ingredientes"):
+        # --- ANÁLISIS DE PRODUCTOS ---
+        st.subheader("🥩 Análisis de Ingredientes")
+    
+        if not df_items_filtered.empty:
+        
+            # Agrupación segura
+            product_stats = df_items_filtered.groupby('description').agg({
+                'total_line': 'sum',      
+                'quantity': 'sum',        
+                'unit_price': 'mean',     
+                'vendor': lambda x: x.mode()[0] if not x.mode().empty else "Varios"
+            }).reset_index()
+
+            product_stats.columns = ['Producto', 'Gasto Total (€)', 'Cantidad Total', 'Precio Medio (€)', 'Proveedor']
+            product_stats = product_stats.sort_values('Gasto Total (€)', ascending=False)
+
+            tab_gasto, tab_volumen = st.tabs(["💰 Top Gasto", "📦 Top Volumen"])
+        
+            with tab_gasto:
+                chart_gasto = alt.Chart(product_stats.head(10)).mark_bar().encode(
+                    x=alt.X('Gasto Total (€)', title='Euros Gastados'),
+                    y=alt.Y('Producto', sort='-x'),
+                    color=alt.Color('Gasto Total (€)', scale=alt.Scale(scheme='orangered')),
+                    tooltip=['Producto', 'Gasto Total (€)', 'Proveedor']
+                ).properties(height=350)
+                st.altair_chart(chart_gasto, use_container_width=True)
+
+            with tab_volumen:
+                stats_qty = product_stats.sort_values('Cantidad Total', ascending=False).head(10)
+                chart_qty = alt.Chart(stats_qty).mark_bar().encode(
+                    x=alt.X('Cantidad Total', title='Cantidad'),
+                    y=alt.Y('Producto', sort='-x'),
+                    color=alt.Color('Cantidad Total', scale=alt.Scale(scheme='blues')),
+                    tooltip=['Producto', 'Cantidad Total', 'Proveedor']
+                ).properties(height=350)
+                st.altair_chart(chart_qty, use_container_width=True)
+
+            st.write("#### 📋 Detalle")
+            st.dataframe(
+                product_stats,
+                column_config={
+                    "Gasto Total (€)": st.column_config.ProgressColumn(
+                        "Gasto Total",
+                        format="%.2f €",
+                        min_value=0,
+                        max_value=float(product_stats['Gasto Total (€)'].max()),
+                    ),
+                    "Cantidad Total": st.column_config.NumberColumn("Cantidad", format="%.2f"),
+                    "Precio Medio (€)": st.column_config.NumberColumn("Precio Medio", format="%.2f €"),
+                },
+                hide_index=True,
+                use_container_width=True
+            )
+        else:
+            st.warning("No hay productos registrados en este periodo.")
+
+@st.fragment
+def render_inflation_detector(df_items):
+    """Fragmento: depende del histórico completo de ítems. Cambiar de producto solo re-ejecuta esto."""
+    with measure("Detector de inflación"):
+        # --- DETECTOR DE INFLACIÓN ---
+        st.subheader("📈 Detector de Inflación")
+    
+        # Usamos TODOS los items históricos, no solo los filtrados, para ver la evolución real
+        todos_items = sorted(df_items['description'].unique()) if not df_items.empty else []
+    
+        col_sel, col_info = st.columns([2, 1])
+        with col_sel:
+            item_seleccionado = st.selectbox("Buscar evolución de precio:", todos_items)
+
+        if item_seleccionado:
+            # Filtramos historial completo de ese item
+            historial = df_items[df_items['description'] == item_seleccionado].sort_values('date')
+        
+            if not historial.empty:
+                # Gráfico de línea temporal
+                chart_line = alt.Chart(historial).mark_line(point=True).encode(
+                    x=alt.X('date:T', title='Fecha', axis=alt.Axis(format='%d/%m/%y')),
+                    y=alt.Y('unit_price', title='Precio Unitario (€)', scale=alt.Scale(zero=False)), # zero=False para ver mejor las variaciones pequeñas
+                    tooltip=[
+                        alt.Tooltip('date', title='Fecha', format='%d-%m-%Y'), 
+                        alt.Tooltip('unit_price', title='Precio', format='.2f€'),
+                        'vendor'
+                    ]
+                ).interactive()
+                st.altair_chart(chart_line, use_container_width=True)
+            
+                # Estadísticas rápidas
+                with col_info:
+                    curr_price = historial.iloc[-1]['unit_price']
+                    avg_price = historial['unit_price'].mean()
+                    delta = ((curr_price - avg_price) / avg_price) * 100
+                
+                    st.metric("Precio Última Compra", f"{curr_price:.2f}€", f"{delta:.1f}% vs Media")
+                    st.caption(f"Min: {historial['unit_price'].min():.2f}€ | Max: {historial['unit_price'].max():.2f}€")
+                
+            else:
+                st.info("Sin datos suficientes para graficar.")
+
+@st.fragment
+def render_vendor_comparison(user_id):
+    """
+    Fragmento: lee directamente la matriz de precios (vendor_prices), sin recorrer invoice_items.
+    """
+    with measure("Mejor proveedor"):
+        st.subheader("🏷️ Mejor Proveedor por Producto")
+
+        # Usuarios con datos anteriores a la matriz: se construye una vez en el primario
+        if not st.session_state.get("vendor_matrix_ready"):
+            db = get_db_session()
+            try:
+                if ensure_user_matrix(db, user_id):
+                    db.commit()
+            except IntegrityError:
+                # Otra sesión del mismo usuario la ha construido a la vez
+                db.rollback()
+            finally:
+                db.close()
+            st.session_state["vendor_matrix_ready"] = True
+
+        db = get_read_session(st.session_state)
+        try:
+            comparison = vendor_comparison(db, user_id)
+        finally:
+            db.close()
+
+        if comparison.empty:
+            st.info("Aún no hay productos comprados a más de un proveedor.")
+            return
+
+        ahorro = comparison["Ahorro Estimado (€)"].sum()
+        st.metric("Ahorro potencial", f"{ahorro:,.2f}€", help="Si lo comprado al proveedor habitual se hubiera comprado al más barato")
+        st.dataframe(
+            comparison,
+            column_config={
+                "Precio Habitual (€)": st.column_config.NumberColumn("Precio Habitual", format="%.2f €"),
+                "Media Reciente (€)": st.column_config.NumberColumn(
+                    "Media Reciente", format="%.2f €", help="Media ponderada que da más peso a las últimas compras"
+                ),
+                "Precio Más Barato (€)": st.column_config.NumberColumn("Precio Más Barato", format="%.2f €"),
+                "Ahorro (%)": st.column_config.NumberColumn("Ahorro", format="%.1f %%"),
+                "Ahorro Estimado (€)": st.column_config.NumberColumn("Ahorro Estimado", format="%.2f €"),
+            },
+            hide_index=True,
+            use_container_width=True
+        )
 
 def render_dashboard_view():
     st.title("📊 Control de Costes y Compras")
+    st.session_state["show_dashboard_metrics"] = st.sidebar.toggle("⏱️ Mostrar tiempos", value=False)
+
+    # Solo esta parte (y por tanto todo) se re-ejecuta al cambiar los filtros de la barra lateral.
+    # Los fragmentos reciben sus datos como argumentos y se re-ejecutan por separado.
+    with measure("Resumen y filtros"):
+        df_items, df_items_filtered = _render_dashboard_summary()
+
+    if df_items is None:
+        return
+
+    render_product_analysis(df_items_filtered)
+
+    st.divider()
+
+    render_inflation_detector(df_items)
+
+    st.divider()
+
+    render_vendor_comparison(st.session_state.user.id)
+
+def _render_dashboard_summary():
+    """
+    Parte no fragmentada: carga de datos, filtros de la barra lateral y KPIs.
+    Devuelve (df_items, df_items_filtered) o (None, None) si no hay datos.
+    """
 
     df_invoices, df_items = load_data()
 
     if df_invoices.empty:
         st.info("👋 ¡Hola! Aún no tienes datos. Ve a 'Subir Facturas' para empezar.")
-        return
+        return None, None
 
     # --- BARRA LATERAL (FILTROS) ---
     st.sidebar.header("📅 Filtros de Tiempo")
@@ -154,99 +374,4 @@ def render_dashboard_view():
     col3.metric("Proveedores", proveedores_unicos)
     col4.metric("Prod. Frecuente", top_prod)
 
-    # --- ANÁLISIS DE PRODUCTOS ---
-    st.subheader("🥩 Análisis de Ingredientes")
-    
-    if not df_items_filtered.empty:
-        
-        # Agrupación segura
-        product_stats = df_items_filtered.groupby('description').agg({
-            'total_line': 'sum',      
-            'quantity': 'sum',        
-            'unit_price': 'mean',     
-            'vendor': lambda x: x.mode()[0] if not x.mode().empty else "Varios"
-        }).reset_index()
-
-        product_stats.columns = ['Producto', 'Gasto Total (€)', 'Cantidad Total', 'Precio Medio (€)', 'Proveedor']
-        product_stats = product_stats.sort_values('Gasto Total (€)', ascending=False)
-
-        tab_gasto, tab_volumen = st.tabs(["💰 Top Gasto", "📦 Top Volumen"])
-        
-        with tab_gasto:
-            chart_gasto = alt.Chart(product_stats.head(10)).mark_bar().encode(
-                x=alt.X('Gasto Total (€)', title='Euros Gastados'),
-                y=alt.Y('Producto', sort='-x'),
-                color=alt.Color('Gasto Total (€)', scale=alt.Scale(scheme='orangered')),
-                tooltip=['Producto', 'Gasto Total (€)', 'Proveedor']
-            ).properties(height=350)
-            st.altair_chart(chart_gasto, use_container_width=True)
-
-        with tab_volumen:
-            stats_qty = product_stats.sort_values('Cantidad Total', ascending=False).head(10)
-            chart_qty = alt.Chart(stats_qty).mark_bar().encode(
-                x=alt.X('Cantidad Total', title='Cantidad'),
-                y=alt.Y('Producto', sort='-x'),
-                color=alt.Color('Cantidad Total', scale=alt.Scale(scheme='blues')),
-                tooltip=['Producto', 'Cantidad Total', 'Proveedor']
-            ).properties(height=350)
-            st.altair_chart(chart_qty, use_container_width=True)
-
-        st.write("#### 📋 Detalle")
-        st.dataframe(
-            product_stats,
-            column_config={
-                "Gasto Total (€)": st.column_config.ProgressColumn(
-                    "Gasto Total",
-                    format="%.2f €",
-                    min_value=0,
-                    max_value=float(product_stats['Gasto Total (€)'].max()),
-                ),
-                "Cantidad Total": st.column_config.NumberColumn("Cantidad", format="%.2f"),
-                "Precio Medio (€)": st.column_config.NumberColumn("Precio Medio", format="%.2f €"),
-            },
-            hide_index=True,
-            use_container_width=True
-        )
-    else:
-        st.warning("No hay productos registrados en este periodo.")
-
-    st.divider()
-
-    # --- DETECTOR DE INFLACIÓN ---
-    st.subheader("📈 Detector de Inflación")
-    
-    # Usamos TODOS los items históricos, no solo los filtrados, para ver la evolución real
-    todos_items = sorted(df_items['description'].unique()) if not df_items.empty else []
-    
-    col_sel, col_info = st.columns([2, 1])
-    with col_sel:
-        item_seleccionado = st.selectbox("Buscar evolución de precio:", todos_items)
-
-    if item_seleccionado:
-        # Filtramos historial completo de ese item
-        historial = df_items[df_items['description'] == item_seleccionado].sort_values('date')
-        
-        if not historial.empty:
-            # Gráfico de línea temporal
-            chart_line = alt.Chart(historial).mark_line(point=True).encode(
-                x=alt.X('date:T', title='Fecha', axis=alt.Axis(format='%d/%m/%y')),
-                y=alt.Y('unit_price', title='Precio Unitario (€)', scale=alt.Scale(zero=False)), # zero=False para ver mejor las variaciones pequeñas
-                tooltip=[
-                    alt.Tooltip('date', title='Fecha', format='%d-%m-%Y'), 
-                    alt.Tooltip('unit_price', title='Precio', format='.2f€'),
-                    'vendor'
-                ]
-            ).interactive()
-            st.altair_chart(chart_line, use_container_width=True)
-            
-            # Estadísticas rápidas
-            with col_info:
-                curr_price = historial.iloc[-1]['unit_price']
-                avg_price = historial['unit_price'].mean()
-                delta = ((curr_price - avg_price) / avg_price) * 100
-                
-                st.metric("Precio Última Compra", f"{curr_price:.2f}€", f"{delta:.1f}% vs Media")
-                st.caption(f"Min: {historial['unit_price'].min():.2f}€ | Max: {historial['unit_price'].max():.2f}€")
-                
-        else:
-            st.info("Sin datos suficientes para graficar.")
\ No newline at end of file
+    return df_items, df_items_filtered
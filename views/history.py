@@ -1,13 +1,196 @@
+import os
 import streamlit as st
 import pandas as pd
-from database.connection import get_db_session
-from database.models import Invoice, InvoiceItem
+from datetime import date, timedelta
+from functools import partial
+from database.connection import get_db_session, get_read_session, record_write, PARTITION_BY_MONTH
+from database.partitions import ensure_month_partition
+from database.models import Invoice, InvoiceItem, DocumentFingerprint
+from services.search import search_invoices
+from services.export import export_invoices, read_export
+from services.storage import load_thumbnail, load_document, document_mime_type
+from services.history_batch import compute_diff, apply_history_diff, check_date, INVOICE_COLUMNS, ITEM_COLUMNS
+from services.price_matrix import affected_keys, refresh_keys
+from services.data_version import bump_data_version
+
+def render_batch_editor(db_write, user_id):
+    """
+    Edición en lote de un mes: los cambios se acumulan en el navegador (form) y al
+    pulsar 'Aplicar' se aplica el diff completo en una sola transacción.
+    """
+    st.subheader("🧹 Edición en Lote")
+    c1, c2 = st.columns(2)
+    hoy = date.today()
+    year = c1.number_input("Año", min_value=2000, max_value=2100, value=hoy.year, step=1)
+    month = c2.selectbox("Mes", list(range(1, 13)), index=hoy.month - 1)
+    start = f"{int(year):04d}-{month:02d}-01"
+    end = f"{int(year) + 1:04d}-01-01" if month == 12 else f"{int(year):04d}-{month + 1:02d}-01"
+
+    invoices = db_write.query(Invoice)\
+        .filter(Invoice.user_id == user_id, Invoice.date >= start, Invoice.date < end)\
+        .order_by(Invoice.date).all()
+    if not invoices:
+        st.caption("No hay facturas en ese mes.")
+        return
+
+    invoice_rows = [
+        {"id": inv.id, "vendor": inv.vendor, "date": str(inv.date), "total_amount": inv.total_amount,
+         "currency": inv.currency, "delete": False}
+        for inv in invoices
+    ]
+    items = db_write.query(InvoiceItem)\
+        .filter(InvoiceItem.user_id == user_id, InvoiceItem.invoice_id.in_([inv.id for inv in invoices]))\
+        .order_by(InvoiceItem.invoice_id, InvoiceItem.id).all()
+    item_rows = [
+        {"id": it.id, "invoice_id": it.invoice_id, "description": it.description, "quantity": it.quantity,
+         "unit_price": it.unit_price, "total_price": it.total_price, "delete": False}
+        for it in items
+    ]
+
+    # Los data_editor guardan las ediciones por posición de fila: tras aplicar, las filas
+    # cambian de orden, así que se estrenan claves nuevas para no re-aplicarlas a otras
+    version = st.session_state.get("batch_editor_version", 0)
+
+    with st.form("batch_form"):
+        st.caption("Facturas")
+        edited_invoices = st.data_editor(
+            pd.DataFrame(invoice_rows), hide_index=True, use_container_width=True,
+            disabled=["id"], key=f"batch_invoices_{start}_{version}",
+            column_config={"delete": st.column_config.CheckboxColumn("🗑️")},
+        )
+        st.caption("Productos")
+        edited_items = st.data_editor(
+            pd.DataFrame(item_rows), hide_index=True, use_container_width=True,
+            disabled=["id", "invoice_id"], key=f"batch_items_{start}_{version}",
+            column_config={"delete": st.column_config.CheckboxColumn("🗑️")},
+        )
+        submitted = st.form_submit_button("💾 Aplicar cambios", type="primary")
+
+    if submitted:
+        invoice_updates, invoice_deletes = compute_diff(invoice_rows, edited_invoices.to_dict("records"), INVOICE_COLUMNS)
+        item_updates, item_deletes = compute_diff(item_rows, edited_items.to_dict("records"), ITEM_COLUMNS)
+        if not (invoice_updates or invoice_deletes or item_updates or item_deletes):
+            st.info("No hay cambios.")
+            return
+        try:
+            resumen = apply_history_diff(db_write, user_id, invoice_updates, invoice_deletes, item_updates, item_deletes)
+        except Exception as e:
+            st.error(f"No se aplicó ningún cambio: {e}")
+            return
+        record_write(st.session_state)
+        st.session_state["batch_editor_version"] = version + 1
+        st.toast(
+            f"{resumen['invoices_updated']} facturas editadas, {resumen['invoices_deleted']} eliminadas · "
+            f"{resumen['items_updated']} productos editados, {resumen['items_deleted']} eliminados",
+            icon="✅"
+        )
+        st.rerun()
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _cached_thumbnail(document_key):
+    # Miniatura ya generada al guardar: aquí solo se lee (y se cachea), nunca se decodifica el original
+    return load_thumbnail(document_key)
+
+def render_document_preview(invoice):
+    """Miniatura de la factura seleccionada; el original solo se descarga si se pide."""
+    if not invoice.image_url:
+        st.caption("Sin documento original guardado.")
+        return
+
+    thumb = _cached_thumbnail(invoice.image_url)
+    if thumb:
+        st.image(thumb, width=240)
+    else:
+        st.caption("📄 Documento PDF")
+
+    if st.button("🔍 Ver original", key=f"doc_{invoice.id}"):
+        st.download_button("⬇️ Descargar original", load_document(invoice.image_url),
+                           file_name=invoice.image_url, mime=document_mime_type(invoice.image_url))
+
+def render_export(db, user_id):
+    """
+    Exportación para contabilidad. El fichero se genera en disco en streaming
+    y solo se guarda su ruta en la sesión, no los datos.
+    """
+    with st.expander("📥 Exportar para contabilidad"):
+        c1, c2, c3 = st.columns(3)
+        d_from = c1.date_input("Desde", date.today() - timedelta(days=90), key="export_from")
+        d_to = c2.date_input("Hasta", date.today(), key="export_to")
+        fmt = c3.selectbox("Formato", ["csv", "xlsx"], key="export_fmt")
+
+        if st.button("Generar exportación"):
+            # Borramos la exportación anterior de esta sesión
+            previous = st.session_state.pop("export_file", None)
+            if previous and os.path.exists(previous["path"]):
+                os.remove(previous["path"])
+
+            try:
+                with st.spinner("Generando fichero..."):
+                    path, mime_type, count = export_invoices(db, user_id, d_from, d_to, fmt)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.session_state["export_file"] = {
+                    "path": path,
+                    "mime": mime_type,
+                    "name": f"sousbill_{d_from}_{d_to}.{fmt}",
+                    "rows": count,
+                }
+
+        export_file = st.session_state.get("export_file")
+        if export_file and os.path.exists(export_file["path"]):
+            st.caption(f"{export_file['rows']} líneas exportadas.")
+            # Callable: el fichero solo se lee al pulsar, no en cada rerun de la página.
+            # Al pulsar sí se carga entero en memoria (limitación de Streamlit): ver EXPORT_MAX_BYTES
+            st.download_button(
+                "⬇️ Descargar", partial(read_export, export_file["path"]),
+                file_name=export_file["name"], mime=export_file["mime"], on_click="ignore",
+            )
+
+def render_search(db, user_id):
+    """
+    Buscador por proveedor o producto. Al pulsar 'Abrir' se preselecciona
+    la factura en el bloque de edición de abajo.
+    """
+    query = st.text_input("🔎 Buscar por proveedor o producto", placeholder="Ej: Makro, aceite de oliva...")
+
+    # Si cambia la búsqueda volvemos a la primera página
+    if st.session_state.get("history_search_query") != query:
+        st.session_state["history_search_query"] = query
+        st.session_state["history_search_page"] = 0
+    page = st.session_state.get("history_search_page", 0)
+
+    if not query:
+        return
+
+    hits, has_more = search_invoices(db, user_id, query, page=page)
+    if not hits:
+        st.caption("Sin resultados.")
+        return
+
+    for hit in hits:
+        c1, c2 = st.columns([5, 1])
+        c1.markdown(f"**{hit['vendor']}** · {hit['date']} · {hit['total_amount']:.2f} {hit['currency']}")
+        c1.caption(f"Coincide: {hit['match']}")
+        if c2.button("Abrir", key=f"open_{hit['invoice_id']}"):
+            st.session_state["history_selected_id"] = hit["invoice_id"]
+
+    p1, p2, p3 = st.columns([1, 4, 1])
+    if page > 0 and p1.button("⬅️ Anterior"):
+        st.session_state["history_search_page"] = page - 1
+        st.rerun()
+    p2.caption(f"Página {page + 1}")
+    if has_more and p3.button("Siguiente ➡️"):
+        st.session_state["history_search_page"] = page + 1
+        st.rerun()
 
 def render_history_view():
     st.header("🗂️ Historial y Gestión de Facturas")
 
     
-    db = get_db_session()
+    # Listado y búsqueda -> réplica de lectura. Edición/borrado -> primario.
+    db = get_read_session(st.session_state)
+    db_write = get_db_session()
     user_id = st.session_state.user.id
     
     try:
@@ -34,20 +217,36 @@ def render_history_view():
         st.dataframe(df, use_container_width=True, hide_index=True)
         st.divider()
 
+        render_export(db, user_id)
+        render_search(db, user_id)
+        st.divider()
+
+        render_batch_editor(db_write, user_id)
+        st.divider()
+
         
         st.subheader("✏️ Editar o Eliminar")
         
         
         opciones = [f"{inv.id} - {inv.vendor} ({inv.total_amount})" for inv in invoices]
-        seleccion = st.selectbox("Selecciona la factura a gestionar:", opciones)
+        # Preselección desde el buscador
+        ids = [inv.id for inv in invoices]
+        selected_from_search = st.session_state.get("history_selected_id")
+        index = ids.index(selected_from_search) if selected_from_search in ids else 0
+        seleccion = st.selectbox("Selecciona la factura a gestionar:", opciones, index=index)
         
         
         selected_id = int(seleccion.split(" - ")[0])
         
         
-        invoice_to_edit = db.query(Invoice).get(selected_id)
+        # Se carga desde el primario: es la copia que vamos a modificar
+        invoice_to_edit = db_write.query(Invoice)\
+            .filter(Invoice.id == selected_id, Invoice.user_id == user_id)\
+            .first()
 
         if invoice_to_edit:
+
+            render_document_preview(invoice_to_edit)
             
             with st.expander("📝 Modificar Datos", expanded=True):
                 with st.form("update_form"):
@@ -62,14 +261,36 @@ def render_history_view():
                     submitted = st.form_submit_button("💾 Guardar Cambios")
                     
                     if submitted:
-                        invoice_to_edit.vendor = new_vendor
-                        invoice_to_edit.date = new_date
-                        invoice_to_edit.total_amount = new_total
-                        invoice_to_edit.currency = new_currency
-                        
-                        db.commit()
-                        st.success("¡Factura actualizada correctamente!")
-                        st.rerun()
+                        # La fecha es la clave de partición y se compara como texto (filtros, exportación)
+                        new_date = new_date.strip()
+                        try:
+                            check_date(new_date)
+                        except ValueError as e:
+                            st.error(str(e))
+                        else:
+                            if PARTITION_BY_MONTH:
+                                # Cerrar la lectura en curso: la partición se crea en otra transacción
+                                db_write.rollback()
+                                ensure_month_partition(new_date)
+
+                            # Celdas de la matriz de precios con el proveedor/fecha ANTERIORES
+                            claves = affected_keys(db_write, user_id, invoice_ids=[invoice_to_edit.id])
+
+                            invoice_to_edit.vendor = new_vendor
+                            invoice_to_edit.date = new_date
+                            invoice_to_edit.total_amount = new_total
+                            invoice_to_edit.currency = new_currency
+                            # Mantener las copias desnormalizadas de los ítems
+                            invoice_to_edit.sync_items()
+
+                            db_write.flush()
+                            refresh_keys(db_write, user_id, claves | affected_keys(db_write, user_id, invoice_ids=[invoice_to_edit.id]))
+                            bump_data_version(db_write, user_id)
+
+                            db_write.commit()
+                            record_write(st.session_state)
+                            st.success("¡Factura actualizada correctamente!")
+                            st.rerun()
 
             
             st.write("")
@@ -82,12 +303,21 @@ def render_history_view():
             with col_del2:
                 
                 if st.button("🗑️ Eliminar", type="primary"):
-                    db.delete(invoice_to_edit) 
-                    db.commit()
+                    claves = affected_keys(db_write, user_id, invoice_ids=[invoice_to_edit.id])
+                    db_write.query(DocumentFingerprint)\
+                        .filter(DocumentFingerprint.invoice_id == invoice_to_edit.id)\
+                        .delete(synchronize_session=False)
+                    db_write.delete(invoice_to_edit) 
+                    db_write.flush()
+                    refresh_keys(db_write, user_id, claves)
+                    bump_data_version(db_write, user_id)
+                    db_write.commit()
+                    record_write(st.session_state)
                     st.toast("Factura eliminada", icon="🗑️")
                     st.rerun()
                     
     except Exception as e:
         st.error(f"Error cargando historial: {e}")
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+        db_write.close()
\ No newline at end of file
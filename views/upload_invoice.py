@@ -1,9 +1,19 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-from services.gemini import analyze_invoice
-from database.connection import get_db_session
+from services.extraction import extract_invoice, confirm_extraction, tier_stats
+from services.storage import save_document, StorageError
+from services.price_matrix import record_purchase
+from services.data_version import bump_data_version
+from database.connection import get_db_session, get_read_session, record_write, PARTITION_BY_MONTH
+from database.partitions import ensure_month_partition
 from database.models import Invoice, InvoiceItem
+from services.duplicates import fingerprint, find_duplicate_uploads, find_duplicate_invoices, save_fingerprint
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _fingerprint_upload(bytes_data, mime_type):
+    # Cacheado: cada rerun de la página no vuelve a decodificar la imagen
+    return fingerprint(bytes_data, mime_type)
 
 def render_upload_view():
     st.header("📤 Subir Facturas")
@@ -39,15 +49,35 @@ def render_upload_view():
 
         with col2:
             st.subheader("Análisis IA")
+
+            # Antes de gastar una llamada a la IA, comprobamos si ya subimos este documento
+            phash, sha256 = _fingerprint_upload(uploaded_file.getvalue(), uploaded_file.type)
+            # Del primario: en la réplica podría faltar una factura recién guardada
+            db = get_db_session()
+            try:
+                duplicados = find_duplicate_uploads(db, st.session_state.user.id, phash, sha256)
+                avisos = [f"{inv.vendor} · {inv.date} · {inv.total_amount:.2f} {inv.currency}" for _, inv in duplicados[:3]]
+            finally:
+                db.close()
+
+            confirmar = True
+            if avisos:
+                st.warning("⚠️ Parece que esta factura ya está guardada:\n\n- " + "\n- ".join(avisos))
+                confirmar = st.checkbox("Es una factura distinta, analizar igualmente")
             
             # Botón para iniciar el análisis
-            if st.button("✨ Analizar con Gemini", type="primary"):
+            if st.button("✨ Analizar con Gemini", type="primary", disabled=not confirmar):
                 with st.spinner("🤖 Leyendo factura (esto puede tardar unos segundos)..."):
                     
                     # --- AQUÍ ESTABA EL ERROR ANTES ---
                     # Ahora pasamos 'uploaded_file' DIRECTAMENTE a la función
                     # No guardamos nada en disco.
-                    datos = analyze_invoice(uploaded_file)
+                    # Primero se intenta leer localmente (PDF con texto + plantilla del proveedor)
+                    db = get_read_session(st.session_state)
+                    try:
+                        datos, tier, pdf_text = extract_invoice(db, st.session_state.user.id, uploaded_file)
+                    finally:
+                        db.close()
                     
                     if datos is None:
                         st.error("Error desconocido: La IA no devolvió nada.")
@@ -56,8 +86,14 @@ def render_upload_view():
                     else:
                         # Si todo sale bien, guardamos los datos en la "memoria" de la app
                         st.session_state['current_invoice'] = datos
+                        st.session_state['current_fingerprint'] = (phash, sha256)
+                        st.session_state['current_extraction'] = {"tier": tier, "text": pdf_text, "data": datos}
                         st.toast("¡Factura leída con éxito!", icon="🎉")
 
+            with st.expander("📊 Rendimiento de extracción"):
+                for stat in tier_stats():
+                    st.caption(f"{stat['tier']}: {stat['count']} ({stat['pct']:.0f}%) · {stat['avg_ms']:.0f} ms de media")
+
     # 3. Formulario de Revisión y Guardado
     # Solo mostramos esto si ya tenemos datos analizados en memoria
     if 'current_invoice' in st.session_state:
@@ -65,6 +101,17 @@ def render_upload_view():
         
         st.divider()
         st.subheader("📝 Revisar y Guardar")
+
+        # Segunda red: mismo proveedor, fecha y total (p.ej. PDF del email + foto del papel)
+        db = get_db_session()
+        try:
+            iguales = find_duplicate_invoices(
+                db, st.session_state.user.id, data.get("vendor"), data.get("date"), data.get("total_amount")
+            )
+        finally:
+            db.close()
+        if iguales:
+            st.warning(f"⚠️ Ya tienes {len(iguales)} factura(s) de {data.get('vendor')} del {data.get('date')} con el mismo total.")
         
         with st.form("save_invoice_form"):
             col_a, col_b = st.columns(2)
@@ -86,6 +133,11 @@ def render_upload_view():
             
             if submitted:
                 try:
+                    # Partición del mes antes de abrir la transacción de guardado
+                    invoice_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+                    if PARTITION_BY_MONTH:
+                        ensure_month_partition(invoice_date)
+
                     # Conexión a Base de Datos
                     session = get_db_session()
                     
@@ -97,7 +149,7 @@ def render_upload_view():
                     new_invoice = Invoice(
                         user_id=current_user_id, # <--- ¡AQUÍ ESTÁ LA CLAVE!
                         vendor=vendor,
-                        date=datetime.strptime(date_str, "%Y-%m-%d").date(),
+                        date=invoice_date,
                         total_amount=total, # Asegúrate de usar el nombre correcto según tu models.py (total o total_amount)
                         currency=currency
                     )
@@ -105,21 +157,59 @@ def render_upload_view():
                     session.flush() # Nos da el ID de la factura
                     
                     # 3. Crear los Ítems (igual que antes)
+                    saved_items = []
                     for index, row in edited_items.iterrows():
                         item = InvoiceItem(
                             invoice_id=new_invoice.id,
+                            user_id=current_user_id,
+                            date=invoice_date,
                             description=row.get("description", "Item"),
                             quantity=float(row.get("quantity", 1)),
                             unit_price=float(row.get("unit_price", 0)),
                             total_price=float(row.get("total", 0)) # Ojo: en tu modelo pusiste total_price
                         )
                         session.add(item)
+                        saved_items.append({"description": item.description, "quantity": item.quantity, "unit_price": item.unit_price})
+
+                    # Matriz de precios por proveedor: actualización incremental
+                    record_purchase(session, current_user_id, vendor, invoice_date, saved_items)
                     
+                    # Aprender/actualizar la plantilla local del proveedor con los datos confirmados
+                    extraction = st.session_state.get('current_extraction')
+                    if extraction:
+                        confirmed = {
+                            "vendor": vendor,
+                            "date": date_str,
+                            "currency": currency,
+                            "total_amount": total,
+                            "items": edited_items.to_dict("records"),
+                        }
+                        confirm_extraction(
+                            session, current_user_id, extraction["text"], extraction["tier"],
+                            extraction["data"], confirmed
+                        )
+
+                    if 'current_fingerprint' in st.session_state:
+                        phash, sha256 = st.session_state['current_fingerprint']
+                        save_fingerprint(session, current_user_id, new_invoice.id, phash, sha256)
+
+                        # Guardamos el original (y su miniatura) si sigue siendo el documento analizado
+                        if uploaded_file and _fingerprint_upload(uploaded_file.getvalue(), uploaded_file.type)[1] == sha256:
+                            try:
+                                new_invoice.image_url = save_document(uploaded_file.getvalue(), uploaded_file.type, sha256)
+                            except StorageError as e:
+                                # La factura se guarda igual, solo sin el original
+                                st.warning(f"⚠️ {e}. La factura se guardará sin el documento.")
+
+                    bump_data_version(session, current_user_id)
                     session.commit()
+                    record_write(st.session_state)
                     st.success(f"✅ Factura guardada para el usuario {st.session_state.user.email}")
                     
                     # Limpiamos memoria
                     del st.session_state['current_invoice']
+                    st.session_state.pop('current_fingerprint', None)
+                    st.session_state.pop('current_extraction', None)
                     session.close()
                     
                 except AttributeError: